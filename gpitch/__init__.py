@@ -8,8 +8,18 @@ from . import audio
 from . import pianoroll
 from . import sgpr_ss
 from . import pdgp
+from . import windowopt
 from . import separation
 from . import transcription
+from . import parallel
+from . import audiocache
+from . import convergence
+from . import checkpoint
+from . import toeplitz
+from . import feature_gpr
+from . import statespace
+from . import gramcache
+from . import varopt
 
 from . import  kernelfit
 from . import  samplecov
@@ -1,21 +1,61 @@
 import numpy as np
-from gpitch import readaudio, segmented
-from gpitch import window_overlap
+import soundfile
+from gpitch import readaudio, readblocks, readsegment, segmented, block_scale
+from gpitch import window_overlap, audiocache
 
 
-class Audio:
-    def __init__(self, path=None, filename=None, frames=-1, start=0, scaled=False, window_size=None, overlap=True):
+class FileWindows:
+    """
+    Windows of an audio file read from disk only when they are accessed. It behaves like a list of ws x 1 arrays.
+    """
+    def __init__(self, fname, n, ws, hop, start=0, beta=1.):
+        self.fname = fname
+        self.ws = ws
+        self.hop = hop
+        self.start = start
+        self.beta = beta
+        self.nw = (n - ws) // hop + 1
+
+    def __len__(self):
+        return self.nw
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.nw))]
+        if i < 0:
+            i += self.nw
+        if not 0 <= i < self.nw:
+            raise IndexError("window index out of range")
+        return readsegment(self.fname, start=self.start + i*self.hop, frames=self.ws, beta=self.beta)
+
+    def __iter__(self):
+        for i in range(self.nw):
+            yield self[i]
+
+
+class Audio(object):
+    def __init__(self, path=None, filename=None, frames=-1, start=0, scaled=False, window_size=None, overlap=True,
+                 views=False, lazy=False, cache=None):
 
         self.path = path
+        self.views = views  # windows as zero-copy views of the data
+        self.lazy = lazy  # windows read from disk only when they are used
+        self._x, self._y = None, None
+
+        if lazy:
+            self.read_lazy(filename=filename, frames=frames, start=start, scaled=scaled, window_size=window_size,
+                           overlap=overlap)
+            return
 
         if path is None:
             self.name = 'unnamed'
             self.fs = 16000
             self.x = np.linspace(0., (self.fs - 1.)/self.fs,  self.fs).reshape(-1, 1)
             self.y = np.cos(2*np.pi*self.x*440.)
+            self.start, self.frames, self.scaled = 0, self.fs, False
 
         else:
-            self.read(filename=filename, frames=frames, start=start, scaled=scaled)
+            self.read(filename=filename, frames=frames, start=start, scaled=scaled, cache=cache)
 
         if window_size is None:
             window_size = self.x.size
@@ -23,15 +63,72 @@ class Audio:
 
         self.X, self.Y = self.windowed(overlap)
 
-    def read(self, filename, frames=-1, start=0, scaled=False):
+    @property
+    def x(self):
+        """time vector, built when first used by a lazy instance"""
+        if self._x is None and self.lazy:
+            self._x = np.linspace(0., (self.frames - 1.)/self.fs, self.frames).reshape(-1, 1)
+        return self._x
+
+    @x.setter
+    def x(self, value):
+        self._x = value
+
+    @property
+    def y(self):
+        """audio, for a lazy instance a read-only memory map from the audio cache (see audiocache.load)"""
+        if self._y is None and self.lazy:
+            self._y = audiocache.load(self.path + self.name, start=self.start, frames=self.frames,
+                                      scaled=self.scaled)[0]
+        return self._y
+
+    @y.setter
+    def y(self, value):
+        self._y = value
+
+    def read(self, filename, frames=-1, start=0, scaled=False, cache=None):
+        self.name = filename
+        self.x, self.y, self.fs = readaudio(fname=self.path + filename, frames=frames, start=start, scaled=scaled,
+                                            cache=cache)
+        self.start, self.frames, self.scaled = start, self.y.size, scaled
+
+    def read_lazy(self, filename, frames=-1, start=0, scaled=False, window_size=None, overlap=True):
+        """
+        Keep only the file information. The windows are read from disk when they are accessed, x and y the first time
+        they are used.
+        """
         self.name = filename
-        self.x, self.y, self.fs = readaudio(fname=self.path + filename, frames=frames, start=start, scaled=scaled)
+        fname = self.path + filename
+        info = soundfile.info(fname)
+        self.fs = info.samplerate
+        n = info.frames - start if frames < 0 else min(frames, info.frames - start)
+        self.start, self.frames, self.scaled = start, n, scaled
+        beta = block_scale(fname, frames=n, start=start) if scaled else 1.
+
+        if window_size is None:
+            window_size = n
+        self.wsize = window_size
+        hop = (window_size - 1) // 2 if overlap else window_size
+        self.X = window_overlap.TimeWindows(n=n, ws=window_size, hop=hop, fs=self.fs)
+        self.Y = FileWindows(fname, n=n, ws=window_size, hop=hop, start=start, beta=beta)
+
+    def blocks(self, blocksize=65536, overlap=0, frames=-1, start=0, scaled=False):
+        """
+        Iterate over the audio of this instance (the segment of the file it was read from) in mono blocks, see
+        methods.readblocks. "start" and the yielded offsets are sample indices relative to the segment, like x.
+        """
+        frames = self.frames - start if frames < 0 else min(frames, self.frames - start)
+        for offset, y in readblocks(self.path + self.name, blocksize=blocksize, overlap=overlap, frames=frames,
+                                    start=self.start + start, scaled=scaled):
+            yield offset - self.start, y
 
-    def windowed(self, overlap):
+    def windowed(self, overlap, views=None):
+        if views is None:
+            views = self.views
         if overlap:
-            xwin, ywin = window_overlap.windowed(x=self.x, y=self.y, ws=self.wsize)
+            xwin, ywin = window_overlap.windowed(x=self.x, y=self.y, ws=self.wsize, views=views)
         else:
-            xwin, ywin = segmented(x=self.x, y=self.y, window_size=self.wsize)
+            xwin, ywin = segmented(x=self.x, y=self.y, window_size=self.wsize, views=views)
 
         self.X, self.Y = xwin, ywin
         return xwin, ywin
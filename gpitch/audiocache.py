@@ -0,0 +1,92 @@
+import os
+import hashlib
+import numpy as np
+import tempfile
+import soundfile
+
+
+# the cache is used by default if this environment variable is set to a directory
+cache_dir = os.environ.get('GPITCH_CACHE_DIR', None)
+
+# directory used when the cache is asked for explicitly but GPITCH_CACHE_DIR is not set
+default_dir = os.path.join(tempfile.gettempdir(), 'gpitch_cache')
+
+
+def enabled():
+    """True if a cache directory has been set"""
+    return cache_dir is not None
+
+
+def tomono(y):
+    """average channels, returns a column vector"""
+    if len(y.shape) == 2 and y.shape[1] > 1:
+        y = np.mean(y, 1)
+    return y.reshape(-1, 1)
+
+
+def normalize(y):
+    """divide by the absolute max, silent audio is returned unchanged"""
+    beta = np.max(np.abs(y))
+    if beta == 0.:
+        return y
+    return y / beta
+
+
+def directory_or_default(directory=None):
+    """the given directory, else GPITCH_CACHE_DIR, else default_dir"""
+    if directory is not None:
+        return directory
+    return cache_dir if cache_dir is not None else default_dir
+
+
+def cache_key(fname, start=0, frames=-1, scaled=False):
+    """
+    Key of a decoded segment of audio, it depends on the file (absolute path and modification time), the segment
+    read (start and frames) and the scaling.
+    """
+    fname = os.path.abspath(fname)
+    key = repr((fname, os.path.getmtime(fname), start, frames, scaled))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def decode(fname, start=0, frames=-1, scaled=False):
+    """decode audio as a mono column vector, optionally divided by its absolute max"""
+    y, fs = soundfile.read(fname, frames=frames, start=start)
+    y = tomono(y)
+    if scaled:
+        y = normalize(y)
+    return y, fs
+
+
+def load(fname, start=0, frames=-1, scaled=False, directory=None):
+    """
+    Decoded audio from the cache, as a read-only memory map of a .npy file. The file is decoded and stored the first
+    time. Processes loading the same audio share the page cache instead of holding private copies. The cache lives
+    in "directory", by default GPITCH_CACHE_DIR or, if that is not set, default_dir.
+    :return: audio (column vector), sample frequency
+    """
+    directory = directory_or_default(directory)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    path = os.path.join(directory, cache_key(fname, start=start, frames=frames, scaled=scaled) + '.npy')
+    if not os.path.exists(path):
+        y = decode(fname, start=start, frames=frames, scaled=scaled)[0]
+
+        # write to a temporary file first, so other processes never see a partial file
+        tmp = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.save(f, y)
+        os.rename(tmp, path)
+
+    return np.load(path, mmap_mode='r'), soundfile.info(fname).samplerate
+
+
+def clear(directory=None):
+    """remove all cached files"""
+    directory = directory_or_default(directory)
+    if not os.path.isdir(directory):
+        return
+    for name in os.listdir(directory):
+        if name.endswith('.npy'):
+            os.remove(os.path.join(directory, name))
@@ -0,0 +1,104 @@
+import os
+import hashlib
+import numpy as np
+import h5py
+
+
+def data_hash(y):
+    """SHA-1 of an array, to recognize the data a checkpoint was written for"""
+    return hashlib.sha1(np.ascontiguousarray(y, dtype=float).tobytes()).hexdigest()
+
+
+class Checkpoint:
+    """
+    Incremental checkpoint of a window by window optimization in an HDF5 file. Every finished window is written (and
+    flushed) as soon as it is available, in chunked datasets with one chunk per window. Opening an existing file with
+    resume=True keeps the windows already finished, see done().
+
+    The fingerprint is a dictionary describing the run (data, pitches, window size and model options). It is stored in
+    the attributes of a new file, and an existing file written with a different fingerprint is not resumed.
+
+    Datasets: done (nwin), niter (nwin), matrix_var and matrix_len (npitches x nwin) and, if ws is given, mean and var
+    (nwin x ws), smean and svar (nwin x ws x nsources).
+    """
+    def __init__(self, filename, nwin, npitches, ws=None, nsources=None, resume=True, fingerprint=None):
+        mode = 'a' if resume and os.path.exists(filename) else 'w'
+        self.file = h5py.File(filename, mode)
+        self.nwin = nwin
+
+        if fingerprint is not None:
+            self.check(fingerprint, new=mode == 'w')
+
+        self.create('done', (nwin, ), bool, (nwin, ))
+        self.create('niter', (nwin, ), float, (nwin, ))
+        self.create('matrix_var', (npitches, nwin), float, (npitches, 1))
+        self.create('matrix_len', (npitches, nwin), float, (npitches, 1))
+        if ws is not None:
+            self.create('mean', (nwin, ws), float, (1, ws))
+            self.create('var', (nwin, ws), float, (1, ws))
+            self.create('smean', (nwin, ws, nsources), float, (1, ws, nsources))
+            self.create('svar', (nwin, ws, nsources), float, (1, ws, nsources))
+
+    def check(self, fingerprint, new):
+        """Store the fingerprint in a new file, or compare it with the one of the file being resumed"""
+        for key in sorted(fingerprint.keys()):
+            value = str(fingerprint[key])
+            if new:
+                self.file.attrs[key] = value
+                continue
+            stored = self.file.attrs.get(key)
+            if isinstance(stored, bytes):
+                stored = stored.decode()
+            if stored != value:
+                self.file.close()
+                raise ValueError("checkpoint was written for a different run, " + key + " is " + str(stored) +
+                                 ", expected " + value + " (use resume=False to start again)")
+
+    def create(self, name, shape, dtype, chunks):
+        if name in self.file:
+            if self.file[name].shape != shape:
+                raise ValueError("checkpoint dataset " + name + " has shape " + str(self.file[name].shape) +
+                                 ", expected " + str(shape))
+        else:
+            self.file.create_dataset(name, shape=shape, dtype=dtype, chunks=chunks)
+
+    def done(self, i):
+        """True if window i is already in the checkpoint"""
+        return bool(self.file['done'][i])
+
+    def num_done(self):
+        return int(np.sum(self.file['done'][:]))
+
+    def write(self, i, variance, lengthscale=None, niter=None, mean=None, var=None, smean=None, svar=None):
+        """Write the results of window i, smean and svar are lists with one ws x 1 array per source"""
+        self.file['matrix_var'][:, i] = np.asarray(variance, dtype=float).reshape(-1, )
+        if lengthscale is not None:
+            self.file['matrix_len'][:, i] = np.asarray(lengthscale, dtype=float).reshape(-1, )
+        if niter is not None:
+            self.file['niter'][i] = niter
+        if mean is not None:
+            self.file['mean'][i] = np.asarray(mean).reshape(-1, )
+            self.file['var'][i] = np.asarray(var).reshape(-1, )
+        if smean is not None:
+            self.file['smean'][i] = np.hstack([np.asarray(m).reshape(-1, 1) for m in smean])
+            self.file['svar'][i] = np.hstack([np.asarray(v).reshape(-1, 1) for v in svar])
+
+        # the window is marked as finished only after all its results are written
+        self.file['done'][i] = True
+        self.file.flush()
+
+    def read(self, i):
+        """Results of window i, in the same format as write"""
+        out = dict(variance=self.file['matrix_var'][:, i],
+                   lengthscale=self.file['matrix_len'][:, i],
+                   niter=self.file['niter'][i])
+        if 'mean' in self.file:
+            out['mean'] = self.file['mean'][i].reshape(-1, 1)
+            out['var'] = self.file['var'][i].reshape(-1, 1)
+            smean, svar = self.file['smean'][i], self.file['svar'][i]
+            out['smean'] = [smean[:, [k]] for k in range(smean.shape[1])]
+            out['svar'] = [svar[:, [k]] for k in range(svar.shape[1])]
+        return out
+
+    def close(self):
+        self.file.close()
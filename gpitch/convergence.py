@@ -0,0 +1,111 @@
+import time
+import numpy as np
+from scipy.optimize import minimize, OptimizeResult
+from gpflow.model import ObjectiveWrapper
+
+
+class StopOptimization(Exception):
+    """Raised by ConvergenceMonitor to stop the optimizer"""
+    pass
+
+
+class ConvergenceMonitor:
+    """
+    Track the bound during the optimization of one window. The optimization stops when the relative improvement of the
+    bound over the last "window" iterations is below "rtol", or when the window has been optimized for more than
+    "max_time" seconds. The reason why it stopped ('tolerance', 'time', or else the one given by stop_reason) is kept
+    in self.reason.
+    """
+    def __init__(self, rtol=1e-4, window=10, max_time=None):
+        self.rtol = rtol
+        self.window = window
+        self.max_time = max_time
+        self.reset()
+
+    def reset(self):
+        self.bounds = []  # bound after every iteration
+        self.last = [None, -np.inf]  # last point evaluated and its bound
+        self.x = None  # point of the last iteration
+        self.reason = None
+        self.start = time.time()
+
+    def objective(self, fun):
+        """wrap an objective function (returning minus the bound and its gradient) to record the bound"""
+        def obj(x):
+            f, g = fun(x)
+            self.last = [x.copy(), -f]
+            return f, g
+        return obj
+
+    def callback(self, x):
+        """called by the optimizer after every iteration"""
+        self.x = x.copy()
+        self.bounds.append(self.last[1])
+        nit = len(self.bounds)
+
+        if nit > self.window:
+            old = self.bounds[-1 - self.window]
+            improvement = (self.bounds[-1] - old) / max(np.abs(old), 1e-12)
+            if improvement < self.rtol:
+                self.reason = 'tolerance'
+                raise StopOptimization()
+
+        if self.max_time is not None and time.time() - self.start > self.max_time:
+            self.reason = 'time'
+            raise StopOptimization()
+
+    def summary(self):
+        return dict(reason=self.reason, niter=len(self.bounds), time=time.time() - self.start,
+                    bound=self.bounds[-1] if len(self.bounds) > 0 else None)
+
+
+def stop_reason(result):
+    """
+    Reason why scipy stopped, from the status of its OptimizeResult: 'converged', 'maxiter' (too many iterations or
+    evaluations), 'nan' (the bound is not finite) or 'failed: <message>' (e.g. the line search failed).
+    """
+    if result.success:
+        return 'converged'
+    if not np.all(np.isfinite(result.fun)):
+        return 'nan'
+    if result.status == 1:
+        return 'maxiter'
+    message = result.message
+    if isinstance(message, bytes):
+        message = message.decode()
+    return 'failed: ' + str(message)
+
+
+def optimize(model, monitor=None, maxiter=1000, disp=False, method='L-BFGS-B'):
+    """
+    Optimize a gpflow model like model.optimize, but stop as soon as the monitor says the bound has converged.
+    Returns a scipy OptimizeResult, with the reason why it stopped in "message" (see stop_reason) and the wall-clock
+    time in "time", also without a monitor. "success" is True when the monitor stopped the optimization, and the one
+    of scipy otherwise.
+    """
+    if monitor is None:
+        start = time.time()
+        result = model.optimize(method=method, maxiter=maxiter, disp=disp)
+        result.message = stop_reason(result)
+        result.time = time.time() - start
+        return result
+
+    if model._needs_recompile:
+        model._compile()
+
+    monitor.reset()
+    obj = monitor.objective(ObjectiveWrapper(model._objective))
+    try:
+        result = minimize(fun=obj, x0=model.get_free_state(), method=method, jac=True, callback=monitor.callback,
+                          options=dict(disp=disp, maxiter=maxiter))
+        monitor.reason = stop_reason(result)
+        success = result.success
+        x = result.x
+    except StopOptimization:
+        success = True
+        x = monitor.x
+
+    model.set_state(x)
+    summary = monitor.summary()
+    return OptimizeResult(x=x, nit=summary['niter'], message=summary['reason'], success=success,
+                          fun=-summary['bound'] if summary['bound'] is not None else None, time=summary['time'])
@@ -0,0 +1,81 @@
+import numpy as np
+import tensorflow as tf
+import gpflow
+from gpflow import settings
+
+
+float_type = settings.dtypes.float_type
+
+
+def has_features(kern):
+    """
+    True if the kernel is finite rank, i.e. it provides features(X) (N x F) with K(X, X2) = features(X)
+    features(X2)^T. Sums of finite rank kernels are finite rank. The features of the cosine kernels are only valid for
+    one dimensional inputs, so kernels on more than one input dimension are treated as not finite rank.
+    """
+    if isinstance(kern, gpflow.kernels.Add):
+        return all([has_features(k) for k in kern.kern_list])
+    return getattr(kern, 'finite_rank', False) and kern.input_dim == 1
+
+
+def kernel_features(kern, X):
+    """Features of a finite rank kernel, the features of a sum are the concatenation of the features of its parts"""
+    if isinstance(kern, gpflow.kernels.Add):
+        return tf.concat([kernel_features(k, X) for k in kern.kern_list], 1)
+    return kern.features(X)
+
+
+class FeatureGPR(gpflow.gpr.GPR):
+    """
+    Gaussian process regression with exact inference through the Woodbury identity for finite rank kernels. With F
+    features, K = Phi Phi^T and
+
+        (Phi Phi^T + s I)^-1 = (I - Phi (s I + Phi^T Phi)^-1 Phi^T) / s
+
+    so only F x F matrices are factorized: O(N F^2) time and O(N F) memory, instead of O(N^3) and O(N^2). Kernels
+    that are not finite rank (see has_features) fall back to the dense GPR.
+    """
+    def __init__(self, X, Y, kern, mean_function=None):
+        gpflow.gpr.GPR.__init__(self, X=X, Y=Y, kern=kern, mean_function=mean_function)
+        self.woodbury = has_features(kern)
+
+    def build_factors(self):
+        """Features of the data, Cholesky factor of A = I + Phi^T Phi / s and c = LA^-1 Phi^T (Y - mean) / s"""
+        err = self.Y - self.mean_function(self.X)
+        phi = kernel_features(self.kern, self.X)
+        num_features = tf.shape(phi)[1]
+        A = tf.eye(num_features, dtype=float_type) + tf.matmul(phi, phi, transpose_a=True) / self.likelihood.variance
+        LA = tf.cholesky(A)
+        c = tf.matrix_triangular_solve(LA, tf.matmul(phi, err, transpose_a=True), lower=True) / \
+            self.likelihood.variance
+        return err, LA, c
+
+    def build_likelihood(self):
+        if not self.woodbury:
+            return gpflow.gpr.GPR.build_likelihood(self)
+
+        err, LA, c = self.build_factors()
+        num_data = tf.cast(tf.shape(self.Y)[0], float_type)
+        output_dim = tf.cast(tf.shape(self.Y)[1], float_type)
+
+        # log det(K) = N log(s) + log det(A)
+        logdet = num_data * tf.log(self.likelihood.variance) + 2. * tf.reduce_sum(tf.log(tf.matrix_diag_part(LA)))
+        quad = tf.reduce_sum(tf.square(err)) / self.likelihood.variance - tf.reduce_sum(tf.square(c))
+        return -0.5 * num_data * output_dim * np.log(2 * np.pi) - 0.5 * output_dim * logdet - 0.5 * quad
+
+    def build_predict(self, Xnew, full_cov=False):
+        if not self.woodbury:
+            return gpflow.gpr.GPR.build_predict(self, Xnew, full_cov=full_cov)
+
+        err, LA, c = self.build_factors()
+        phi_new = kernel_features(self.kern, Xnew)
+        tmp = tf.matrix_triangular_solve(LA, tf.transpose(phi_new), lower=True)  # F x N*
+        fmean = tf.matmul(tmp, c, transpose_a=True) + self.mean_function(Xnew)
+        if full_cov:
+            fvar = tf.matmul(tmp, tmp, transpose_a=True)
+            shape = tf.stack([1, 1, tf.shape(self.Y)[1]])
+            fvar = tf.tile(tf.expand_dims(fvar, 2), shape)
+        else:
+            fvar = tf.reduce_sum(tf.square(tmp), 0)
+            fvar = tf.tile(tf.reshape(fvar, (-1, 1)), [1, tf.shape(self.Y)[1]])
+        return fmean, fvar
@@ -0,0 +1,103 @@
+import hashlib
+import collections
+import numpy as np
+
+
+def param_values(param):
+    """values of a parameter, of a ParamList of parameters or of an array, as a flat array"""
+    if hasattr(param, 'value'):
+        return np.asarray(param.value, dtype=float).reshape(-1, )
+    if isinstance(param, (list, tuple, np.ndarray)):
+        return np.asarray(param, dtype=float).reshape(-1, )
+    return np.hstack([param_values(p) for p in param.sorted_params])
+
+
+def kernel_key(kern):
+    """
+    Key of the unit variance covariance of a pitch kernel: its class and the values of its energies, frequencies and
+    lengthscales. The variance is not part of the key, it only scales the Gram matrices.
+    """
+    values = [type(kern).__name__]
+    for name in ['lengthscales', 'energy', 'frequency']:
+        if hasattr(kern, name):
+            values.append(np.round(param_values(getattr(kern, name)), 12).tobytes())
+    return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()
+
+
+def grid_key(x, z):
+    """
+    Key of the inputs and inducing inputs of a window, relative to the first input. For stationary kernels windows
+    that are shifted in time share the same Gram matrices. The extrema used as inducing inputs by default (see
+    init_liv) follow the data, so they almost never repeat from window to window: on a synthetic 10 s chord the 79
+    windows gave 79 different keys. Only inducing inputs on a fixed grid relative to the window (e.g. every k-th input)
+    give the same key for all full windows.
+    """
+    x = np.asarray(x, dtype=float).reshape(-1, )
+    z = np.asarray(z, dtype=float).reshape(-1, )
+    rel = np.round(np.hstack([x - x[0], [np.nan], z - x[0]]), 10)
+    return hashlib.sha1(rel.tobytes()).hexdigest()
+
+
+def pitch_grams(kern, x, z):
+    """
+    Unit variance Gram matrices of a pitch kernel: Kuf (M x N), Kuu (M x M) and Kdiag (N). Multiplied by the variance of
+    the kernel they give its covariances.
+    """
+    variance = float(kern.variance.value)
+    Kuf = kern.compute_K(z, x) / variance
+    Kuu = kern.compute_K_symm(z) / variance
+    Kdiag = kern.compute_Kdiag(x).reshape(-1, ) / variance
+    return Kuf, Kuu, Kdiag
+
+
+class GramCache:
+    """
+    LRU cache of the unit variance Gram matrices of pitch kernels, keyed on the kernel hyperparameters and on the
+    relative grid and inducing pattern of a window. The cache holds at most max_bytes, the least recently used entries
+    are evicted first. With inducing inputs that change from window to window it only hits when the same windows are
+    seen again (see grid_key), check hit_rate.
+    """
+    def __init__(self, max_bytes=512*2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = collections.OrderedDict()
+
+    def get(self, kern, x, z):
+        """Gram matrices (Kuf, Kuu, Kdiag) of a pitch kernel on window x with inducing inputs z"""
+        key = (kernel_key(kern), grid_key(x, z))
+        if key in self.entries:
+            self.hits += 1
+            grams = self.entries.pop(key)
+            self.entries[key] = grams  # most recently used
+            return grams
+
+        self.misses += 1
+        grams = pitch_grams(kern, x, z)
+        size = sum([g.nbytes for g in grams])
+        if size <= self.max_bytes:
+            while self.nbytes + size > self.max_bytes:
+                old = self.entries.popitem(last=False)[1]
+                self.nbytes -= sum([g.nbytes for g in old])
+            self.entries[key] = grams
+            self.nbytes += size
+        return grams
+
+    def window(self, kern_list, x, z):
+        """Gram matrices of all pitches stacked: Kuf (P x M x N), Kuu (P x M x M) and Kdiag (P x N)"""
+        grams = [self.get(k, x, z) for k in kern_list]
+        return (np.stack([g[0] for g in grams]), np.stack([g[1] for g in grams]),
+                np.stack([g[2] for g in grams]))
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def hit_rate(self):
+        """fraction of the Gram matrices taken from the cache"""
+        return self.hits / max(float(self.hits + self.misses), 1.)
+
+    def summary(self):
+        return dict(entries=len(self.entries), nbytes=self.nbytes, hits=self.hits, misses=self.misses,
+                    hit_rate=self.hit_rate())
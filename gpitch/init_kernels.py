@@ -1,5 +1,6 @@
+import numpy as np
 from gpflow.kernels import Matern32
-from matern12_spectral_mixture import MercerMatern12sm
+from matern12_spectral_mixture import MercerMatern12sm, PitchKernelBank
 import pickle
 
 
@@ -13,8 +14,9 @@ def init_kern_act(num_pitches):
     return kern_act
 
 
-def init_kern_com(num_pitches, lengthscale, energy, frequency, len_fixed=True):
-    """Initialize kernels for activations and components"""
+def init_kern_com(num_pitches, lengthscale, energy, frequency, len_fixed=True, vectorized=False):
+    """Initialize kernels for activations and components, vectorized=True holds the partials of each pitch in
+    vector parameters (see MercerMatern12sm)"""
 
     kern_com, kern_exp, kern_per = [], [], []
 
@@ -33,11 +35,24 @@ def init_kern_com(num_pitches, lengthscale, energy, frequency, len_fixed=True):
                             lengthscales=lengthscale[i].copy(),
                             energy=energy[i].copy(),
                             frequency=frequency[i].copy(),
-                            len_fixed=len_fixed)
+                            len_fixed=len_fixed,
+                            vectorized=vectorized)
                         )
     return kern_com
 
 
+def init_kern_bank(lengthscale, energy, frequency, len_fixed=True):
+    """
+    Initialize the sum of all pitch kernels as one PitchKernelBank, with the same free parameters as
+    np.sum(init_kern_com(...)): variances, lengthscales (unless len_fixed), energies and frequencies
+    """
+    return PitchKernelBank(1,
+                           energy=[e.copy() for e in energy],
+                           frequency=[f.copy() for f in frequency],
+                           lengthscales=[np.asarray(l).reshape(-1, )[0] for l in lengthscale],
+                           len_fixed=len_fixed)
+
+
 def init_kern(num_pitches, lengthscale, energy, frequency):
     """Initialize kernels for activations and components"""
 
@@ -6,6 +6,29 @@ import gpflow
 from scipy import signal
 
 
+def envelope(y, win_size=1600):
+    """Energy envelope, absolute value of the data smoothed with a Hann window"""
+    win = signal.hann(win_size)
+    return signal.convolve(np.abs(y.reshape(-1, )), win, mode='same') / sum(win)
+
+
+def window_energy(Y, win_size=1600):
+    """Mean of the energy envelope of every window in the list Y"""
+    return np.array([np.mean(envelope(Y[i], win_size=win_size)) for i in range(len(Y))])
+
+
+def energy_gate(Y, thres=0.01, win_size=1600):
+    """
+    Detect silent windows. Returns a boolean array that is True for windows whose energy, relative to the most
+    energetic window, is at least thres, and the fraction of windows below the threshold.
+    """
+    energy = window_energy(Y, win_size=win_size)
+    if np.max(energy) > 0.:
+        energy /= np.max(energy)
+    active = energy >= thres
+    return active, 1. - np.mean(active)
+
+
 def init_liv(x, y, num_sources=1, win_size=9, thres=0.0025, dec=1):
     """
     Initialize location of inducing varibales by using locations of
@@ -16,8 +39,7 @@ def init_liv(x, y, num_sources=1, win_size=9, thres=0.0025, dec=1):
     y = y.reshape(-1, )
 
     # energy
-    win1 = signal.hann(1600)
-    energy = signal.convolve(np.abs(y), win1, mode='same') / sum(win1)
+    energy = envelope(y)
     energy /= np.max(energy)
 
     # smooth signal
@@ -4,6 +4,7 @@ import gpflow
 from gpflow.param import ParamList, Param, transforms
 from gpflow import settings
 from scipy.signal import hann
+from spectral_mixture import SpectralMixture, vector_features, stack_partials
 
 float_type = settings.dtypes.float_type
 jitter = settings.numerics.jitter_level
@@ -59,6 +60,7 @@ class Sig(gpflow.kernels.Kern):
     """
     The sigmoidal kernel with unitary variance.
     """
+    finite_rank = True
 
     def __init__(self, input_dim, a=1.0, b=1.0, active_dims=None):
         """
@@ -85,11 +87,18 @@ class Sig(gpflow.kernels.Kern):
         Xhat = 1. / (1. + tf.exp(-(X * self.a + self.b)))
         return tf.reduce_sum(tf.square(Xhat), 1)
 
+    def features(self, X, presliced=False):
+        """N x D features, K(X, X2) = features(X) features(X2)^T"""
+        if not presliced:
+            X, _ = self._slice(X, None)
+        return 1. / (1. + tf.exp(-(X * self.a + self.b)))
+
 
 class Hann(gpflow.kernels.Kern):
     """
     The Hanning kernel with unitary variance.
     """
+    finite_rank = True
 
     def __init__(self, input_dim, N=1025, active_dims=None):
         """
@@ -114,11 +123,18 @@ class Hann(gpflow.kernels.Kern):
         Xhat = 0.5 * (1. - tf.cos(2.*np.pi*X*16000/(self.N - 1.)) )
         return tf.reduce_sum(tf.square(Xhat), 1)
 
+    def features(self, X, presliced=False):
+        """N x D features, K(X, X2) = features(X) features(X2)^T"""
+        if not presliced:
+            X, _ = self._slice(X, None)
+        return 0.5 * (1. - tf.cos(2.*np.pi*X*16000/(self.N - 1.)))
+
 
 class Cosine(gpflow.kernels.Kern):
     """
     The Cosine kernel with frequency hyperparameter, instead of lengthscale
     """
+    finite_rank = True
 
     def __init__(self, input_dim, variance=1., frequency=1.):
         gpflow.kernels.Kern.__init__(self, input_dim, active_dims=None)
@@ -147,6 +163,13 @@ class Cosine(gpflow.kernels.Kern):
         r = self.euclid_dist(X, X2)
         return self.variance * tf.cos(r)
 
+    def features(self, X, presliced=False):
+        """N x 2 features [cos, sin], K(X, X2) = features(X) features(X2)^T (one dimensional inputs)"""
+        if not presliced:
+            X, _ = self._slice(X, None)
+        arg = 2. * np.pi * self.frequency * X
+        return tf.sqrt(self.variance) * tf.concat([tf.cos(arg), tf.sin(arg)], 1)
+
     def Kdiag(self, X, presliced=False):
         return tf.fill(tf.stack([tf.shape(X)[0]]), tf.squeeze(self.variance))
 
@@ -201,12 +224,12 @@ class Matern32sm_old(gpflow.kernels.Kern):
         return var
 
 
-class Matern32sm(gpflow.kernels.Kern):
+class Matern32sm(SpectralMixture):
     """
     Matern spectral mixture kernel with single lengthscale.
     """
-    def __init__(self, input_dim, num_partials, lengthscales=None, variances=None, frequencies=None):
-        gpflow.kernels.Kern.__init__(self, input_dim, active_dims=None)
+    def __init__(self, input_dim, num_partials, lengthscales=None, variances=None, frequencies=None, mode=None):
+        SpectralMixture.__init__(self, input_dim, mode=mode)
         var_l = []
         freq_l = []
         self.ARD = False
@@ -226,31 +249,12 @@ class Matern32sm(gpflow.kernels.Kern):
         self.variance = ParamList(var_l)
         self.frequency = ParamList(freq_l)
 
-    def K(self, X, X2=None, presliced=False):
-        if not presliced:
-            X, X2 = self._slice(X, X2)
-        if X2 is None:
-            X2 = X
-
-        # Introduce dummy dimension so we can use broadcasting
-        f = tf.expand_dims(X, 1)  # now N x 1 x D
-        f2 = tf.expand_dims(X2, 0)  # now 1 x M x D
-        r = tf.sqrt(tf.square(f - f2 +  1e-12))
-
-        r1 = np.sqrt(3.)*tf.reduce_sum(r / self.lengthscales, 2)
-        r2 = tf.reduce_sum(2.*np.pi * self.frequency[0] * r , 2)
-        k = self.variance[0] * (1. + r1) * tf.exp(-r1) * tf.cos(r2)
-
-        for i in range(1, self.num_partials):
-            r2 = tf.reduce_sum(2.*np.pi*self.frequency[i]*r , 2)
-            k += self.variance[i] * (1. + r1) * tf.exp(-r1) * tf.cos(r2)
-        return k
+    def partials(self):
+        return (stack_partials(self.variance, self.num_partials), stack_partials(self.frequency, self.num_partials),
+                self.lengthscales)
 
-    def Kdiag(self, X):
-        var = tf.fill(tf.stack([tf.shape(X)[0]]), tf.squeeze(self.variance[0]))
-        for i in range(1, self.num_partials):
-            var += tf.fill(tf.stack([tf.shape(X)[0]]), tf.squeeze( self.variance[i] ) )
-        return var
+    def envelope(self, r):
+        return (1. + np.sqrt(3.)*r) * tf.exp(-np.sqrt(3.)*r)
 
     def vars_n_freqs_fixed(self, fix_var=True, fix_freq=False):
         for i in range(self.num_partials):
@@ -258,12 +262,14 @@ class Matern32sm(gpflow.kernels.Kern):
             self.frequency[i].fixed = fix_freq
 
 
-class Matern32sml(gpflow.kernels.Kern):
+class Matern32sml(SpectralMixture):
     """
-    Matern spectral mixture kernel with single lengthscale.
+    Matern spectral mixture kernel with one lengthscale per partial.
     """
-    def __init__(self, input_dim, num_partials, lengthscales=None, variances=None, frequencies=None):
-        gpflow.kernels.Kern.__init__(self, input_dim, active_dims=None)
+    shared_lengthscale = False
+
+    def __init__(self, input_dim, num_partials, lengthscales=None, variances=None, frequencies=None, mode=None):
+        SpectralMixture.__init__(self, input_dim, mode=mode)
         len_l = []
         var_l = []
         freq_l = []
@@ -284,32 +290,12 @@ class Matern32sml(gpflow.kernels.Kern):
         self.variance = ParamList(var_l)
         self.frequency = ParamList(freq_l)
 
-    def K(self, X, X2=None, presliced=False):
-        if not presliced:
-            X, X2 = self._slice(X, X2)
-        if X2 is None:
-            X2 = X
-
-        # Introduce dummy dimension so we can use broadcasting
-        f = tf.expand_dims(X, 1)  # now N x 1 x D
-        f2 = tf.expand_dims(X2, 0)  # now 1 x M x D
-        r = tf.sqrt(tf.square(f - f2 +  1e-12))
+    def partials(self):
+        return (stack_partials(self.variance, self.num_partials), stack_partials(self.frequency, self.num_partials),
+                stack_partials(self.lengthscales, self.num_partials))
 
-        r1 = np.sqrt(3.)*tf.reduce_sum(r / self.lengthscales[0], 2)
-        r2 = tf.reduce_sum(2.*np.pi * self.frequency[0] * r , 2)
-        k = self.variance[0] * (1. + r1) * tf.exp(-r1) * tf.cos(r2)
-
-        for i in range(1, self.num_partials):
-            r1 = np.sqrt(3.)*tf.reduce_sum(r / self.lengthscales[i], 2)
-            r2 = tf.reduce_sum(2.*np.pi*self.frequency[i]*r , 2)
-            k += self.variance[i] * (1. + r1) * tf.exp(-r1) * tf.cos(r2)
-        return k
-
-    def Kdiag(self, X):
-        var = tf.fill(tf.stack([tf.shape(X)[0]]), tf.squeeze(self.variance[0]))
-        for i in range(1, self.num_partials):
-            var += tf.fill(tf.stack([tf.shape(X)[0]]), tf.squeeze( self.variance[i] ) )
-        return var
+    def envelope(self, r):
+        return (1. + np.sqrt(3.)*r) * tf.exp(-np.sqrt(3.)*r)
 
     def vars_n_freqs_fixed(self, fix_len = False, fix_var=False, fix_freq=False):
         for i in range(self.num_partials):
@@ -322,21 +308,34 @@ class MercerCosMix(gpflow.kernels.Kern):
     """
     The Mercer Cosine Mixture kernel for audio.
     """
+    finite_rank = True
 
     def __init__(self, input_dim, energy=np.asarray([1.]), frequency=np.asarray([2*np.pi]),
-                 variance=1.0, features_as_params=False):
+                 variance=1.0, features_as_params=False, vectorized=False):
         """
         - input_dim is the dimension of the input to the kernel
         - variance is the (initial) value for the variance parameter(s)
           if ARD=True, there is one variance per input
         - active_dims is a list of length input_dim which controls
           which columns of X are used.
+        - vectorized, if True energies and frequencies are vectors (one Param each if features_as_params) and the
+          features of all partials are computed with one broadcasted outer product.
         """
         gpflow.kernels.Kern.__init__(self, input_dim, active_dims=None)
         self.num_features = len(frequency)
         self.variance = Param(variance, transforms.Logistic(0., 0.25))
-
-        if features_as_params:
+        self.vectorized = vectorized
+
+        if vectorized:
+            energy = np.asarray(energy, dtype=float).reshape(-1, )
+            frequency = np.asarray(frequency, dtype=float).reshape(-1, )
+            if features_as_params:
+                self.energy = Param(energy, transforms.positive)
+                self.frequency = Param(frequency, transforms.positive)
+            else:
+                self.energy = energy
+                self.frequency = frequency
+        elif features_as_params:
             energy_list = []
             frequency_list = []
             for i in range(energy.size):
@@ -350,6 +349,9 @@ class MercerCosMix(gpflow.kernels.Kern):
             self.frequency = frequency
 
     def phi_features(self, X):
+        if self.vectorized:
+            return vector_features(X, self.energy, self.frequency)
+
         n = tf.shape(X)[0]
         m = self.num_features
         phi_list = 2*m*[None]
@@ -375,6 +377,12 @@ class MercerCosMix(gpflow.kernels.Kern):
     def Kdiag(self, X, presliced=False):
         return tf.fill(tf.stack([tf.shape(X)[0]]), tf.squeeze(self.variance))
 
+    def features(self, X, presliced=False):
+        """N x 2m features, K(X, X2) = features(X) features(X2)^T"""
+        if not presliced:
+            X, _ = self._slice(X, None)
+        return tf.sqrt(self.variance) * tf.transpose(self.phi_features(X))
+
 
 class Logistic_hat(gpflow.kernels.Stationary):
     """
@@ -390,12 +398,14 @@ class Logistic_hat(gpflow.kernels.Stationary):
         return self.variance * (f1 - f2)
 
 
-class Spectrum(gpflow.kernels.Kern):
+class Spectrum(SpectralMixture):
     """
-    Matern spectral mixture kernel with single lengthscale.
+    Spectral mixture kernel without envelope.
     """
-    def __init__(self, input_dim, frequency=None, energy=None, variance=1.0):
-        gpflow.kernels.Kern.__init__(self, input_dim, active_dims=None)
+    finite_rank = True
+
+    def __init__(self, input_dim, frequency=None, energy=None, variance=1.0, mode=None):
+        SpectralMixture.__init__(self, input_dim, mode=mode)
 
         self.ARD = False
         self.num_partials = len(frequency)
@@ -404,43 +414,27 @@ class Spectrum(gpflow.kernels.Kern):
         self.variance = Param(variance, transforms.positive)
         self.frequency = frequency
 
-    def K(self, X, X2=None, presliced=False):
-        if not presliced:
-            X, X2 = self._slice(X, X2)
-        if X2 is None:
-            X2 = X
-
-        # Introduce dummy dimension so we can use broadcasting
-        f = tf.expand_dims(X, 1)  # now N x 1 x D
-        f2 = tf.expand_dims(X2, 0)  # now 1 x M x D
-        r = tf.sqrt(tf.square(f - f2 +  1e-12))
-
-        k_list = self.num_partials*[None]
-        for i in range(self.num_partials):
-            r2 = tf.reduce_sum(2.*np.pi*self.frequency[i]*r , 2)
-            k_list[i] = self.energy[i] * tf.cos(r2)
-        k = tf.reduce_sum(k_list, 0)
+    def partials(self):
+        return stack_partials(self.energy, self.num_partials), stack_partials(self.frequency, self.num_partials), None
 
-        return self.variance*k
+    def scale(self):
+        return self.variance
 
     def Kdiag(self, X, presliced=False):
         return tf.fill(tf.stack([tf.shape(X)[0]]), tf.squeeze(self.variance))
 
+    def features(self, X, presliced=False):
+        """N x 2m features, K(X, X2) = features(X) features(X2)^T (one dimensional inputs)"""
+        if not presliced:
+            X, _ = self._slice(X, None)
+        energy, frequency = self.partials()[0:2]
+        return tf.sqrt(self.variance) * tf.transpose(vector_features(X, energy, frequency))
+
 
-class Spectrum2(gpflow.kernels.Kern):
+class Spectrum2(Spectrum):
     """
-    Matern spectral mixture kernel with single lengthscale.
+    Spectral mixture kernel without envelope, on the euclidean distance between inputs.
     """
-    def __init__(self, input_dim, frequency=None, energy=None, variance=1.0):
-        gpflow.kernels.Kern.__init__(self, input_dim, active_dims=None)
-
-        self.ARD = False
-        self.num_partials = len(frequency)
-
-        self.energy = energy
-        self.variance = Param(variance, transforms.positive)
-        self.frequency = frequency
-
     def square_dist_2(self, X, X2):
         X = X
         Xs = tf.reduce_sum(tf.square(X), 1)
@@ -457,22 +451,8 @@ class Spectrum2(gpflow.kernels.Kern):
         r2 = self.square_dist_2(X, X2)
         return 2.*np.pi*freq*tf.sqrt(r2 + 1e-12)
 
-    def K(self, X, X2=None, presliced=False):
-        if not presliced:
-            X, X2 = self._slice(X, X2)
-        if X2 is None:
-            X2 = X
-
-        k_list = self.num_partials*[None]
-        for i in range(self.num_partials):
-            r = self.euclid_dist_2(X, X2, self.frequency[i])
-            k_list[i] = self.energy[i] * tf.cos(r)
-        k = tf.reduce_sum(k_list, 0)
-
-        return self.variance*k
-
-    def Kdiag(self, X, presliced=False):
-        return tf.fill(tf.stack([tf.shape(X)[0]]), tf.squeeze(self.variance))
+    def distance(self, X, X2):
+        return tf.sqrt(self.square_dist_2(X, X2) + 1e-12)
 
 
 class NonParam(gpflow.kernels.Kern):
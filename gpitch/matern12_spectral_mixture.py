@@ -1,8 +1,9 @@
 import numpy as np
 import tensorflow as tf
 import gpflow
-from gpflow.param import ParamList, Param, transforms
+from gpflow.param import ParamList, Param, AutoFlow, transforms
 from gpflow import settings
+from spectral_mixture import SpectralMixture, vector_features, stack_partials
 
 
 float_type = settings.dtypes.float_type
@@ -11,12 +12,29 @@ int_type = settings.dtypes.int_type
 np_float_type = np.float32 if float_type is tf.float32 else np.float64
 
 
-class Matern12sm(gpflow.kernels.Kern):
+def pad_partials(energy, frequency):
+    """
+    Energies and frequencies of P pitches as P x m matrices, padded up to the largest number of partials m. The
+    padding is set to one and masked out: the returned P x m partial mask is zero for it.
+    """
+    num_partials = [np.size(e) for e in energy]
+    shape = (len(energy), max(num_partials))
+    energy_pad, frequency_pad = np.ones(shape, dtype=np_float_type), np.ones(shape, dtype=np_float_type)
+    partial_mask = np.zeros(shape, dtype=np_float_type)
+    for i in range(len(energy)):
+        energy_pad[i, 0:num_partials[i]] = np.asarray(energy[i]).reshape(-1, )
+        frequency_pad[i, 0:num_partials[i]] = np.asarray(frequency[i]).reshape(-1, )
+        partial_mask[i, 0:num_partials[i]] = 1.
+    return energy_pad, frequency_pad, partial_mask
+
+
+class Matern12sm(SpectralMixture):
     """
     Matern spectral mixture kernel with single lengthscale.
     """
-    def __init__(self, input_dim,  variance=1., lengthscales=None, energy=None, frequency=None, len_fixed=False):
-        gpflow.kernels.Kern.__init__(self, input_dim, active_dims=None)
+    def __init__(self, input_dim,  variance=1., lengthscales=None, energy=None, frequency=None, len_fixed=False,
+                 mode=None):
+        SpectralMixture.__init__(self, input_dim, mode=mode)
         energy_l = []
         freq_l = []
         self.ARD = False
@@ -35,31 +53,12 @@ class Matern12sm(gpflow.kernels.Kern):
         if len_fixed:
             self.lengthscales.fixed = True
 
-    def K(self, X, X2=None, presliced=False):
-        if not presliced:
-            X, X2 = self._slice(X, X2)
-        if X2 is None:
-            X2 = X
-
-        # Introduce dummy dimension so we can use broadcasting
-        f = tf.expand_dims(X, 1)  # now N x 1 x D
-        f2 = tf.expand_dims(X2, 0)  # now 1 x M x D
-        r = tf.sqrt(tf.square(f - f2 + 1e-12))
-
-        r1 = tf.reduce_sum(r / self.lengthscales, 2)
-        r2 = tf.reduce_sum(2.*np.pi * self.frequency[0] * r, 2)
-        k = self.energy[0] * tf.cos(r2)
+    def partials(self):
+        return (stack_partials(self.energy, self.num_partials), stack_partials(self.frequency, self.num_partials),
+                self.lengthscales)
 
-        for i in range(1, self.num_partials):
-            r2 = tf.reduce_sum(2.*np.pi*self.frequency[i]*r, 2)
-            k += self.energy[i] * tf.cos(r2)
-        return self.variance * tf.exp(-r1) * k
-
-    def Kdiag(self, X):
-        var = tf.fill(tf.stack([tf.shape(X)[0]]), tf.squeeze(self.energy[0]))
-        for i in range(1, self.num_partials):
-            var += tf.fill(tf.stack([tf.shape(X)[0]]), tf.squeeze(self.energy[i]))
-        return self.variance * var
+    def scale(self):
+        return self.variance
 
     def vars_n_freqs_fixed(self, fix_energy=True, fix_freq=True):
         for i in range(self.num_partials):
@@ -69,26 +68,33 @@ class Matern12sm(gpflow.kernels.Kern):
 
 class MercerMatern12sm(gpflow.kernels.Stationary):
     """
-    The Mercer Matern 1/2 spectral mixture kernel
+    The Mercer Matern 1/2 spectral mixture kernel. With vectorized=True the energies and frequencies of all partials
+    are held in two vector parameters and the features are computed with a single broadcasted outer product,
+    instead of one scalar parameter and one cos/sin pair of ops per partial.
     """
     def __init__(self, input_dim, energy=np.asarray([1.]), frequency=np.asarray([2*np.pi]), variance=1.,
-                 lengthscales=1., len_fixed=False):
+                 lengthscales=1., len_fixed=False, vectorized=False):
         gpflow.kernels.Stationary.__init__(self, input_dim, variance=variance, lengthscales=lengthscales,
                                            active_dims=None, ARD=False)
         # self.variance = Param(variance, transforms.positive())
         # self.lengthscale = Param(lengthscale, transforms.positive())
 
         self.num_partials = len(frequency)
+        self.vectorized = vectorized
 
-        energy_list = []
-        frequency_list = []
+        if vectorized:
+            self.energy = Param(np.asarray(energy, dtype=np_float_type).reshape(-1, ), transforms.positive)
+            self.frequency = Param(np.asarray(frequency, dtype=np_float_type).reshape(-1, ), transforms.positive)
+        else:
+            energy_list = []
+            frequency_list = []
 
-        for i in range(self.num_partials):
-            energy_list.append(Param(energy[i], transforms.positive))
-            frequency_list.append(Param(frequency[i], transforms.positive))
+            for i in range(self.num_partials):
+                energy_list.append(Param(energy[i], transforms.positive))
+                frequency_list.append(Param(frequency[i], transforms.positive))
 
-        self.energy = ParamList(energy_list)
-        self.frequency = ParamList(frequency_list)
+            self.energy = ParamList(energy_list)
+            self.frequency = ParamList(frequency_list)
 
         # self.energy.fixed = True
         # self.frequency.fixed = True
@@ -99,6 +105,16 @@ class MercerMatern12sm(gpflow.kernels.Stationary):
         if len_fixed:
             self.lengthscales.fixed = True
 
+    def set_partials(self, energy, frequency):
+        """Set the values of the energies and frequencies of the partials"""
+        energy = np.asarray(energy, dtype=np_float_type).reshape(-1, )[0:self.num_partials]
+        frequency = np.asarray(frequency, dtype=np_float_type).reshape(-1, )[0:self.num_partials]
+        if self.vectorized:
+            self.energy, self.frequency = energy, frequency
+        else:
+            for k in range(self.num_partials):
+                self.energy[k], self.frequency[k] = energy[k], frequency[k]
+
     def K(self, X, X2=None, presliced=False):
         if not presliced:
             X, X2 = self._slice(X, X2)
@@ -117,10 +133,16 @@ class MercerMatern12sm(gpflow.kernels.Stationary):
             return self.variance * tf.exp(-r) * k
 
     def Kdiag(self, X, presliced=False):
-        var = self.variance * reduce(tf.add, self.energy)
+        if self.vectorized:
+            var = self.variance * tf.reduce_sum(self.energy)
+        else:
+            var = self.variance * reduce(tf.add, self.energy)
         return tf.fill(tf.stack([tf.shape(X)[0]]), tf.squeeze(var))
 
     def phi_features(self, X):
+        if self.vectorized:
+            return vector_features(X, self.energy, self.frequency)
+
         n = tf.shape(X)[0]
         m = self.num_partials
         phi_list = 2*m*[None]
@@ -131,3 +153,145 @@ class MercerMatern12sm(gpflow.kernels.Stationary):
         phi = tf.stack(phi_list)
 
         return tf.reshape(phi, (2*m, n))
+
+
+class PitchKernelBank(gpflow.kernels.Kern):
+    """
+    Sum of P Mercer Matern 1/2 spectral mixture kernels (one per pitch) evaluated as one batched op. Energies and
+    frequencies of all pitches are P x m matrix parameters, padded up to the largest number of partials m and with
+    the padding masked out of the features, variances and lengthscales are vector parameters (P). The free
+    parameters are the same as in np.sum of MercerMatern12sm kernels. The distance matrix is computed once and
+    shared by all pitches, the features of all pitches are computed with one broadcasted outer product and the per
+    pitch Gram matrices with one batched matmul, so the size of the graph does not grow with P.
+
+    kern_list[i] is a light view of pitch i, with variance, lengthscales, K, Kdiag and compute_K like a
+    MercerMatern12sm, so that code written for np.sum(kern_pitches) (e.g. SGPRSS.build_predict_source) keeps working.
+    """
+    def __init__(self, input_dim, energy, frequency, lengthscales, variance=None, len_fixed=False):
+        gpflow.kernels.Kern.__init__(self, input_dim, active_dims=None)
+        self.num_pitches = len(energy)
+        self.num_partials = [np.size(e) for e in energy]
+
+        energy_pad, frequency_pad, self.partial_mask = pad_partials(energy, frequency)
+        self.energy = Param(energy_pad, transforms.positive)
+        self.frequency = Param(frequency_pad, transforms.positive)
+
+        if variance is None:
+            variance = np.ones(self.num_pitches)
+        self.variance = Param(np.asarray(variance, dtype=np_float_type).reshape(-1, ), transforms.positive)
+        self.lengthscales = Param(np.asarray(lengthscales, dtype=np_float_type).reshape(-1, ), transforms.positive)
+        if len_fixed:
+            self.lengthscales.fixed = True
+
+        self.kern_list = [PitchView(self, i) for i in range(self.num_pitches)]
+
+    def pitch_params(self, index=None):
+        """
+        energy, frequency, mask of the partials (Q x m), variance and lengthscales (Q) of the pitches in index (all by
+        default)
+        """
+        if index is None:
+            return self.energy, self.frequency, self.partial_mask, self.variance, self.lengthscales
+        return (tf.gather(self.energy, index), tf.gather(self.frequency, index), tf.gather(self.partial_mask, index),
+                tf.gather(self.variance, index), tf.gather(self.lengthscales, index))
+
+    def K_all(self, X, X2=None, index=None):
+        """Gram matrix of every pitch in index (all by default), returns Q x N x M"""
+        if X2 is None:
+            X2 = X
+        energy, frequency, mask, variance, lengthscales = self.pitch_params(index)
+
+        r = tf.sqrt(tf.square(X - tf.transpose(X2)) + 1e-12)  # N x M, shared by all pitches
+        sqrt_energy = tf.expand_dims(mask * tf.sqrt(energy), 1)  # Q x 1 x m
+        arg = 2. * np.pi * tf.expand_dims(X, 0) * tf.expand_dims(frequency, 1)  # Q x N x m
+        arg2 = 2. * np.pi * tf.expand_dims(X2, 0) * tf.expand_dims(frequency, 1)  # Q x M x m
+        phi = tf.concat([sqrt_energy * tf.cos(arg), sqrt_energy * tf.sin(arg)], 2)
+        phi2 = tf.concat([sqrt_energy * tf.cos(arg2), sqrt_energy * tf.sin(arg2)], 2)
+        cos_mix = tf.matmul(phi, phi2, transpose_b=True)  # Q x N x M
+
+        scale = tf.reshape(variance, (-1, 1, 1))
+        return scale * tf.exp(-tf.expand_dims(r, 0) / tf.reshape(lengthscales, (-1, 1, 1))) * cos_mix
+
+    def Kdiag_all(self, X, index=None):
+        """prior variance of every pitch in index at every point, returns Q x N"""
+        energy, frequency, mask, variance, lengthscales = self.pitch_params(index)
+        var = variance * tf.reduce_sum(mask * energy, 1)
+        return tf.tile(tf.expand_dims(var, 1), tf.stack([1, tf.shape(X)[0]]))
+
+    def K(self, X, X2=None, presliced=False):
+        if not presliced:
+            X, X2 = self._slice(X, X2)
+        return tf.reduce_sum(self.K_all(X, X2), 0)
+
+    def Kdiag(self, X, presliced=False):
+        var = tf.reduce_sum(self.variance * tf.reduce_sum(self.partial_mask * self.energy, 1))
+        return tf.fill(tf.stack([tf.shape(X)[0]]), var)
+
+    @AutoFlow((float_type, [None, None]), (float_type, [None, None]), (tf.int32, [None]))
+    def compute_K_pitches(self, X, Z, index):
+        return self.K_all(X, Z, index)
+
+    @AutoFlow((float_type, [None, None]), (tf.int32, [None]))
+    def compute_Kdiag_pitches(self, X, index):
+        return self.Kdiag_all(X, index)
+
+
+class BankValue(object):
+    """
+    entry i of a parameter of a PitchKernelBank, with a .value like a Param (for energies and frequencies the first
+    "size" entries of row i, without the padding)
+    """
+    def __init__(self, bank, name, index, size=None):
+        self.bank, self.name, self.index, self.size = bank, name, index, size
+
+    @property
+    def value(self):
+        value = np.array(getattr(self.bank, self.name).value[self.index])
+        return value if self.size is None else value[0:self.size]
+
+
+class PitchView(object):
+    """Pitch i of a PitchKernelBank, with the interface of a MercerMatern12sm"""
+    def __init__(self, bank, index):
+        self.bank = bank
+        self.index = index
+        self.num_partials = bank.num_partials[index]
+
+    def get(self, name, size=None):
+        if self.bank._tf_mode:
+            value = getattr(self.bank, name)[self.index]
+            return value if size is None else value[0:size]
+        return BankValue(self.bank, name, self.index, size=size)
+
+    def set(self, name, value, size=None):
+        values = getattr(self.bank, name).value.copy()
+        if size is None:
+            values[self.index] = np.asarray(value).reshape(-1, )[0]
+        else:
+            values[self.index, 0:size] = np.asarray(value).reshape(-1, )[0:size]
+        setattr(self.bank, name, values)
+
+    def set_partials(self, energy, frequency):
+        """Set the values of the energies and frequencies of the partials of this pitch"""
+        self.set('energy', energy, self.num_partials)
+        self.set('frequency', frequency, self.num_partials)
+
+    variance = property(lambda self: self.get('variance'), lambda self, value: self.set('variance', value))
+    lengthscales = property(lambda self: self.get('lengthscales'), lambda self, value: self.set('lengthscales', value))
+    energy = property(lambda self: self.get('energy', self.num_partials))
+    frequency = property(lambda self: self.get('frequency', self.num_partials))
+
+    def K(self, X, X2=None, presliced=False):
+        return self.bank.K_all(X, X2, index=[self.index])[0]
+
+    def Kdiag(self, X, presliced=False):
+        return self.bank.Kdiag_all(X, index=[self.index])[0]
+
+    def compute_K(self, X, Z):
+        return self.bank.compute_K_pitches(X, Z, np.array([self.index], dtype=np.int32))[0]
+
+    def compute_K_symm(self, X):
+        return self.compute_K(X, X)
+
+    def compute_Kdiag(self, X):
+        return self.bank.compute_Kdiag_pitches(X, np.array([self.index], dtype=np.int32))[0]
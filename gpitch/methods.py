@@ -11,6 +11,8 @@ import peakutils
 import soundfile
 import pickle
 import time
+import audiocache
+from audiocache import tomono, normalize
 
 
 def loadm(directory, pattern=''):
@@ -33,18 +35,26 @@ def find_ideal_f0(string):
     return ideal_f0
 
 
-def readaudio(fname, frames=-1, start=0, aug=False, scaled=False):
+def readaudio(fname, frames=-1, start=0, aug=False, scaled=False, cache=None):
+    """
+    Read audio as a mono column vector. If cache is True (by default, if a cache directory is set in audiocache) the
+    decoded audio is a read-only memory map from the cache.
+    """
+    if cache is None:
+        cache = audiocache.enabled()
+    if cache:
+        y, fs = audiocache.load(fname, start=start, frames=frames, scaled=scaled)
+        frames = y.size
+        x = np.linspace(0., (frames-1.)/fs, frames).reshape(-1, 1)  # time vector
+        if aug:
+            y = np.append(np.zeros((1000, 1)), y).reshape(-1, 1)
+            x = np.linspace(0., (y.size-1.)/fs, y.size).reshape(-1, 1)
+        return x, y, fs
+
     y, fs = soundfile.read(fname, frames=frames, start=start)  # load data and sample freq
-    if len(y.shape) == 1:
-        y = y.reshape(-1, 1)
-    if y.shape[1] == 2:  # convert to mono
-        y = np.mean(y, 1) 
-    y = y.reshape(-1, 1)
+    y = tomono(y)
     if scaled:
-        beta = np.max(np.abs(y))
-        if beta == 0.:
-            beta = 1.
-        y /= beta
+        y = normalize(y)
     if aug:
         augnum = 1000  # number of zeros to add
         y = np.append(np.zeros((augnum, 1)), y).reshape(-1, 1)
@@ -54,6 +64,38 @@ def readaudio(fname, frames=-1, start=0, aug=False, scaled=False):
     return x, y, fs
 
 
+def readblocks(fname, blocksize=65536, overlap=0, frames=-1, start=0, scaled=False):
+    """
+    Iterate over an audio file in blocks of "blocksize" samples (consecutive blocks share "overlap" samples). Yields
+    the index of the first sample of each block and the mono block as a column vector. The time vector is never built.
+    If scaled, the file is read twice, first to find the absolute max.
+    """
+    beta = 1.
+    if scaled:
+        beta = block_scale(fname, blocksize=blocksize, frames=frames, start=start)
+
+    offset = start
+    for y in soundfile.blocks(fname, blocksize=blocksize, overlap=overlap, frames=frames, start=start):
+        yield offset, tomono(y) / beta
+        offset += blocksize - overlap
+
+
+def block_scale(fname, blocksize=65536, frames=-1, start=0):
+    """absolute max of the mono audio, read in blocks, used to scale it (1 for silent audio)"""
+    beta = 0.
+    for y in soundfile.blocks(fname, blocksize=blocksize, frames=frames, start=start):
+        beta = max(beta, np.max(np.abs(tomono(y))))
+    return 1. if beta == 0. else beta
+
+
+def readsegment(fname, start, frames, beta=1.):
+    """read "frames" samples starting at "start" as a mono column vector divided by "beta" """
+    with soundfile.SoundFile(fname) as f:
+        f.seek(start)
+        y = f.read(frames)
+    return tomono(y) / beta
+
+
 def trim_n_merge(x, trim_size=1600, aug=True):
     xl = []
     for i in range(len(x)):
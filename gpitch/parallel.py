@@ -0,0 +1,202 @@
+import os
+import sys
+import pickle
+import threading
+import traceback
+import subprocess
+import multiprocessing
+import numpy as np
+import gpitch
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+_worker = {}  # state of the current worker process (session, model and settings)
+
+
+def init_worker(spec):
+    """
+    Initialize a worker process. Every worker opens its own tensorflow session and builds its own SGPRSS model, that
+    is then reused for all the windows sent to that worker.
+    """
+    sess, path = gpitch.init_settings(visible_device=spec['gpu'])
+
+    if spec.get('bank', False):
+        kern = gpitch.init_kernels.init_kern_bank(lengthscale=spec['lengthscale'],
+                                                  energy=spec['energy'],
+                                                  frequency=spec['frequency'],
+                                                  len_fixed=spec['len_fixed'])
+    else:
+        kern_pitches = gpitch.init_kernels.init_kern_com(num_pitches=len(spec['lengthscale']),
+                                                         lengthscale=spec['lengthscale'],
+                                                         energy=spec['energy'],
+                                                         frequency=spec['frequency'],
+                                                         len_fixed=spec['len_fixed'],
+                                                         vectorized=spec.get('vectorized', False))
+        kern = np.sum(kern_pitches)
+    x_init, y_init, z_init = spec['window']
+    model = gpitch.sgpr_ss.SGPRSS(X=x_init, Y=y_init, kern=kern, Z=z_init, reg=spec['reg'],
+                                  sparse_source=spec.get('sparse_source', False))
+
+    _worker['sess'] = sess
+    _worker['model'] = model
+    _worker['spec'] = spec
+
+
+def reset_window(model, x, y, z, lengthscale, scale=1., buckets=None):
+    """Set the data of a new window and take hyperparameters back to their initial values"""
+    model.X = x.copy()
+    model.Y = scale*y.copy()
+    model.set_inducing(z, buckets=buckets)
+    model.likelihood.variance = 1.
+
+    for i in range(len(lengthscale)):
+        model.kern.kern_list[i].variance = 1.
+        model.kern.kern_list[i].lengthscales = lengthscale[i].copy()
+
+
+def fit_window(task):
+    """
+    Optimize one window in the current worker. Returns a dictionary with the window index, the learned variances and
+    lengthscales of every pitch, and (if requested) the predictions of the mixture and of the sources.
+    """
+    i, x, y, z = task
+    model = _worker['model']
+    spec = _worker['spec']
+    npitches = len(spec['lengthscale'])
+
+    reset_window(model, x=x, y=y, z=z, lengthscale=spec['lengthscale'], scale=spec['scale'],
+                 buckets=spec.get('buckets'))
+    opt = gpitch.convergence.optimize(model, monitor=spec.get('monitor'), maxiter=spec['maxiter'], disp=spec['disp'])
+
+    result = dict(index=i,
+                  niter=getattr(opt, 'nit', spec['maxiter']),
+                  reason=getattr(opt, 'message', None),
+                  variance=[model.kern.kern_list[j].variance.value.copy() for j in range(npitches)],
+                  lengthscale=[model.kern.kern_list[j].lengthscales.value.copy() for j in range(npitches)])
+
+    if spec['predict']:
+        result['mean'], result['var'], result['smean'], result['svar'] = model.predict_all(x.copy())
+    return result
+
+
+def serve():
+    """
+    Main loop of a worker process started by optimize_windows. Reads the spec and then chunks of tasks (pickled) from
+    stdin, and writes ('ok', results) or ('error', traceback) for every chunk to stdout. Anything the worker prints
+    goes to stderr, stdout is kept for the results.
+    """
+    out = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
+    inp = getattr(sys.stdin, 'buffer', sys.stdin)
+
+    error = None
+    try:
+        init_worker(pickle.load(inp))
+    except Exception:
+        error = traceback.format_exc()
+
+    while True:
+        try:
+            chunk = pickle.load(inp)
+        except EOFError:
+            break
+        if error is not None:
+            message = ('error', error)
+        else:
+            try:
+                message = ('ok', [fit_window(task) for task in chunk])
+            except Exception:
+                message = ('error', traceback.format_exc())
+        pickle.dump(message, out, pickle.HIGHEST_PROTOCOL)
+        out.flush()
+
+
+def start_worker():
+    """Start a new python interpreter running serve, with the same module search path as this one"""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.abspath(p) for p in sys.path if p] + [os.getcwd()])
+    return subprocess.Popen([sys.executable, '-c', 'import gpitch.parallel; gpitch.parallel.serve()'],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+
+
+def feed_worker(proc, spec, chunks, results):
+    """Send chunks to a worker until there are none left, putting (chunk index, status, value) in results"""
+    try:
+        pickle.dump(spec, proc.stdin, pickle.HIGHEST_PROTOCOL)
+        while True:
+            try:
+                k, chunk = chunks.get_nowait()
+            except queue.Empty:
+                break
+            pickle.dump(chunk, proc.stdin, pickle.HIGHEST_PROTOCOL)
+            proc.stdin.flush()
+            status, value = pickle.load(proc.stdout)
+            results.put((k, status, value))
+            if status == 'error':
+                break
+    except (EOFError, IOError, OSError):
+        results.put((None, 'error', 'worker process exited with code ' + str(proc.wait())))
+    finally:
+        try:
+            proc.stdin.close()
+        except (IOError, OSError):
+            pass
+
+
+def optimize_windows(spec, tasks, processes=None, chunksize=1, callback=None):
+    """
+    Optimize windows in a pool of worker processes.
+    :param spec: dictionary with everything required to build the model in each worker
+    :param tasks: iterable of tuples (index, x, y, z), one per window
+    :param processes: number of worker processes, by default the number of cpus
+    :param chunksize: number of windows sent to a worker at once
+    :param callback: function called in the main process with every result as soon as it is available
+    :return: list of results of fit_window, in the same order as tasks
+
+    Every worker is a new python interpreter (see start_worker and serve), not a fork of this process: the parent
+    already holds a tensorflow session (and possibly a CUDA context), which is not safe to fork, and a fresh process
+    is needed for the visible device of init_worker to take effect. This works the same on python 2 and 3, spec and
+    tasks only need to be picklable.
+    """
+    tasks = list(tasks)
+    chunks = queue.Queue()
+    nchunks = 0
+    for k in range(0, len(tasks), chunksize):
+        chunks.put((nchunks, tasks[k:k + chunksize]))
+        nchunks += 1
+    if nchunks == 0:
+        return []
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    results = queue.Queue()
+    procs = [start_worker() for _ in range(min(processes, nchunks))]
+    threads = [threading.Thread(target=feed_worker, args=(proc, spec, chunks, results)) for proc in procs]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    done = nchunks * [None]
+    try:
+        for _ in range(nchunks):
+            k, status, value = results.get()
+            if status == 'error':
+                raise RuntimeError("window optimization failed in a worker process:\n" + value)
+            done[k] = value
+            if callback is not None:
+                for result in value:
+                    callback(result)
+    except BaseException:
+        for proc in procs:
+            if proc.poll() is None:
+                proc.kill()
+        raise
+    finally:
+        for thread in threads:
+            thread.join()
+        for proc in procs:
+            proc.wait()
+    return [result for chunk in done for result in chunk]
@@ -1,53 +1,76 @@
 import numpy as np
-import tensorflow as tf
+from numpy.lib.stride_tricks import as_strided
 
 
-def get_samples(x, num_sam, size):
+def segments(x, size):
     """
-    Infer covariance matrix by sampling segments from a large vector
+    All segments of length size of a vector x, as a read only (N - size + 1) x size strided view of x (no copy)
     """
-    samples = num_sam * [None]
-    for i in range(num_sam):
-        idx = np.random.randint(0, x.size - size)  # sample start index to get audio segment of sise msize
-        samples[i] = x[idx: idx + size].copy()
-    return samples
+    x = np.ascontiguousarray(x).reshape(-1, )
+    return as_strided(x, shape=(x.size - size + 1, size), strides=(x.strides[0], x.strides[0]), writeable=False)
 
 
-def comatrix(X):
+def sample_starts(x, num_sam, size):
+    """random start index of num_sam segments of length size of x"""
+    return np.random.randint(0, np.size(x) - size, size=num_sam)
+
+
+def get_samples(x, num_sam, size, starts=None):
     """
-    Compute the approximate covariance matrix using tensorflow.
+    Infer covariance matrix by sampling segments from a large vector. The segments are gathered at once from a
+    strided view of x and returned as the rows of a num_sam x size matrix.
     """
-    #  get number of samples and vector size
-    num_sam = len(X)
-    vec_size = X[0].size
+    if starts is None:
+        starts = sample_starts(x, num_sam, size)
+    return segments(x, size)[starts]
 
-    #  init cov matrix
-    cov = np.zeros((vec_size, vec_size))
 
-    # define graph
-    vec = tf.placeholder(dtype=tf.float64)  # vector to compute outer product
-    outer = tf.matmul(vec, vec, transpose_b=True)
+def comatrix(X, block=4096):
+    """
+    Compute the approximate covariance matrix (1/num_sam) sum_i x_i x_i^T of the rows of X (num_sam x size, or a
+    list of vectors), accumulated as X_b^T X_b over blocks of "block" rows.
+    """
+    X = np.asarray(X)
+    X = X.reshape(X.shape[0], -1)
+    num_sam, vec_size = X.shape
 
-    with tf.Session() as sess:
-        for i in range(num_sam):
-            cov += sess.run(outer, feed_dict={vec: X[i]})
+    cov = np.zeros((vec_size, vec_size))
+    for start in range(0, num_sam, block):
+        Xb = X[start:start + block].astype(np.float64)
+        cov += Xb.T.dot(Xb)
     return (1./num_sam)*cov
 
 
-def get_cov(x, num_sam, size):
+def stream_comatrix(x, starts, size, block=4096):
     """
-    :param x:
-    :param num_sam:
-    :param size:
-    :return:
-    covariance matrix, samples used, kernel
+    Like comatrix(get_samples(x, ...)), but gathering the segments starting at "starts" one block at a time, so only a
+    block x size matrix of samples is in memory for any number of samples.
     """
-    # samples = lenglist*[None]
-    # cov = lenglist*[None]
-    # kern = lenglist*[None]
+    view = segments(x, size)
+    cov = np.zeros((size, size))
+    for start in range(0, len(starts), block):
+        Xb = view[starts[start:start + block]].astype(np.float64)
+        cov += Xb.T.dot(Xb)
+    return (1./len(starts))*cov
+
 
-    samples = get_samples(x, num_sam, size)
-    cov = comatrix(samples)
+def get_cov(x, num_sam, size, block=4096, keep_samples=True):
+    """
+    :param x: audio signal
+    :param num_sam: number of segments sampled
+    :param size: length of every segment
+    :param block: number of segments per product X_b^T X_b
+    :param keep_samples: if False the samples are streamed in blocks and not returned (samples is None)
+    :return:
+    covariance matrix, kernel, samples used (num_sam x size)
+    """
+    starts = sample_starts(x, num_sam, size)
+    if keep_samples:
+        samples = get_samples(x, num_sam, size, starts=starts)
+        cov = comatrix(samples, block=block)
+    else:
+        samples = None
+        cov = stream_comatrix(x, starts, size, block=block)
     kern = cov[0, :].copy().reshape(-1, 1)
     kern /= np.max(np.abs(kern))
     return cov, kern, samples
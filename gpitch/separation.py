@@ -5,18 +5,23 @@ import gpitch
 import scipy.io
 import matplotlib.pyplot as plt
 from gpitch.audio import Audio
+from gpitch.windowopt import WindowOptimizer
 from scipy import fftpack
 from myplots import plotgp
 from sklearn.metrics import mean_squared_error as mse
 from gpitch import window_overlap
 
 
-class SoSp:
+class SoSp(WindowOptimizer):
     """
     Source separation model class
     """
+    scale = 1.  # see windowopt.WindowOptimizer
+    len_fixed = True
+    predict_sources = True
 
-    def __init__(self, instrument, frames, pitches=None, gpu='0', load=True, reg=False):
+    def __init__(self, instrument, frames, pitches=None, gpu='0', load=True, reg=False, vectorized=False, bank=False,
+                 buckets=None):
 
         # init session
         self.sess, self.path = gpitch.init_settings(visible_device=gpu)
@@ -42,6 +47,13 @@ class SoSp:
         self.var = []
         self.smean = []
         self.svar = []
+        self.niter = []
+        self.warm = []
+        self.active = []
+        self.stop_reason = []
+        self.opt_time = []
+        self.opt_shape = []
+        self.opt_bound = []
 
         self.esource = None
 
@@ -52,6 +64,10 @@ class SoSp:
         ncol = len(self.test_data.Y)
         self.matrix_var = np.zeros((nrow, ncol))
 
+        self.vectorized = vectorized  # partials of each pitch kernel in vector parameters
+        self.bank = bank  # model kernel as one PitchKernelBank instead of a sum of pitch kernels
+        self.num_buckets = buckets  # pad the inducing sets up to this many fixed sizes (see init_buckets)
+        self.buckets = None
         self.init_kernel(load=load)
         self.init_model(reg=reg)
 
@@ -233,7 +249,8 @@ class SoSp:
                                                               lengthscale=self.params[0],
                                                               energy=self.params[1],
                                                               frequency=self.params[2],
-                                                              len_fixed=True)
+                                                              len_fixed=True,
+                                                              vectorized=self.vectorized)
 
     def init_inducing(self):
         nwin = len(self.test_data.X)
@@ -254,18 +271,27 @@ class SoSp:
         self.init_inducing()  # init inducing points
 
         # init model kernel
-        kern_model = np.sum(self.kern_pitches)
+        if self.bank:
+            kern_model = gpitch.init_kernels.init_kern_bank(lengthscale=self.params[0],
+                                                            energy=self.params[1],
+                                                            frequency=self.params[2],
+                                                            len_fixed=True)
+        else:
+            kern_model = np.sum(self.kern_pitches)
 
         # init gp model
         x_init = self.test_data.X[0].copy()
         y_init = self.test_data.Y[0].copy()
         z_init = self.inducing[0][0].copy()
-        self.model = gpitch.sgpr_ss.SGPRSS(X=x_init, Y=y_init, kern=kern_model, Z=z_init, reg=reg)
+        self.model = gpitch.sgpr_ss.SGPRSS(X=x_init, Y=y_init, kern=kern_model, Z=z_init, reg=reg, sparse_source=True)
+        if self.num_buckets is not None:
+            self.init_buckets(num_buckets=self.num_buckets)
+            self.model.set_inducing(z_init, buckets=self.buckets)
 
     def reset_model(self, x, y, z):
         self.model.X = x.copy()
         self.model.Y = y.copy()
-        self.model.Z = z.copy()
+        self.model.set_inducing(z, buckets=self.buckets)
         self.model.likelihood.variance = 1.
         # self.model.likelihood.variance = 0.0001
         # self.model.likelihood.variance.fixed = True
@@ -276,41 +302,145 @@ class SoSp:
             self.model.kern.kern_list[i].variance = 1.
             self.model.kern.kern_list[i].lengthscales = self.params[0][i].copy()
 
-    def optimize(self, maxiter=1000, disp=1, nwin=None):
-
-        self.mean = []
-        self.var = []
-        self.smean = []
-        self.svar = []
-
-        if nwin is None:
-            nwin = len(self.test_data.Y)
-
-        for i in range(nwin):
-
-            # reset model
-            self.reset_model(x=self.test_data.X[i],
-                             y=self.test_data.Y[i],
-                             z=self.inducing[0][i])
-
-            # optimize window
-            print("optimizing window " + str(i))
-            self.model.optimize(disp=disp, maxiter=maxiter)
-
-            # save learned params
-            for j in range(len(self.pitches)):
-                self.matrix_var[j, i] = self.model.kern.kern_list[j].variance.value.copy()
-                # self.matrix_var[j, i] = self.model.kern.kern_list[j].kern_list[0].variance.value.copy()
-
-            # predict mixture function
-            mean, var = self.model.predict_f(self.test_data.X[i].copy())
-            self.mean.append(mean)
-            self.var.append(var)
-
-            # predict sources
-            smean, svar = self.model.predict_s(self.test_data.X[i].copy())
-            self.smean.append(smean)
-            self.svar.append(svar)
+    def window_state(self):
+        """Current noise variance and variance of every pitch kernel"""
+        variance = [self.model.kern.kern_list[i].variance.value.copy() for i in range(len(self.pitches))]
+        return [self.model.likelihood.variance.value.copy(), variance]
+
+    def warm_model(self, state, blend=0.):
+        """
+        Start the current window from the optimum "state" of the previous one. With blend=0 the previous optimum is
+        used as it is, with blend=1 the default initialization (unitary variances) is recovered.
+        """
+        self.model.likelihood.variance = (1. - blend)*state[0] + blend*1.
+        for i in range(len(self.pitches)):
+            self.model.kern.kern_list[i].variance = (1. - blend)*state[1][i] + blend*1.
+
+    def skip_window(self, i):
+        """Fill a silent window with zero means and the prior variances of the sources"""
+        x = self.test_data.X[i]
+        prior = [np.sum(self.params[1][j]) * np.ones((x.shape[0], 1)) for j in range(len(self.pitches))]
+        self.matrix_var[:, i] = 0.
+        self.niter.append(0)
+        self.warm.append(False)
+        self.stop_reason.append('skipped')
+        self.mean.append(np.zeros((x.shape[0], 1)))
+        self.var.append(np.sum(prior, 0))
+        self.smean.append([np.zeros((x.shape[0], 1)) for j in range(len(self.pitches))])
+        self.svar.append(prior)
+
+    def save_window(self, i):
+        """Keep the learned variances of window i and append the predicted mixture and sources"""
+        for j in range(len(self.pitches)):
+            self.matrix_var[j, i] = self.model.kern.kern_list[j].variance.value.copy()
+
+        mean, var, smean, svar = self.model.predict_all(self.test_data.X[i].copy())
+        self.mean.append(mean)
+        self.var.append(var)
+        self.smean.append(smean)
+        self.svar.append(svar)
+
+    def collect_result(self, i, res):
+        """Keep the result of window i optimized by a worker (see parallel.fit_window)"""
+        self.matrix_var[:, i] = np.asarray(res['variance']).reshape(-1, )
+        self.mean.append(res['mean'])
+        self.var.append(res['var'])
+        self.smean.append(res['smean'])
+        self.svar.append(res['svar'])
+
+    def checkpoint_options(self):
+        """the checkpoint also holds the predictions of every window"""
+        return dict(ws=self.test_data.X[0].shape[0], nsources=len(self.pitches))
+
+    def write_result(self, ckpt, res):
+        """Write the result of a worker to the checkpoint"""
+        ckpt.write(res['index'], variance=res['variance'], niter=res['niter'], mean=res['mean'], var=res['var'],
+                   smean=res['smean'], svar=res['svar'])
+
+    def store_window(self, ckpt, i):
+        """Write the last results appended (those of window i) to the checkpoint"""
+        ckpt.write(i, variance=self.matrix_var[:, i], niter=self.niter[-1], mean=self.mean[-1], var=self.var[-1],
+                   smean=self.smean[-1], svar=self.svar[-1])
+
+    def restore_window(self, ckpt, i):
+        """Load the results of window i from the checkpoint instead of optimizing it again"""
+        data = ckpt.read(i)
+        self.matrix_var[:, i] = data['variance']
+        self.niter.append(data['niter'])
+        self.warm.append(False)
+        self.stop_reason.append('checkpoint')
+        self.mean.append(data['mean'])
+        self.var.append(data['var'])
+        self.smean.append(data['smean'])
+        self.svar.append(data['svar'])
+
+    def fit_window(self, x, y, z, maxiter=1000, disp=1):
+        """Optimize a single window, returns the learned variance of every pitch and the predicted sources"""
+        self.reset_model(x=x, y=y, z=z)
+        self.model.optimize(disp=disp, maxiter=maxiter)
+        variance = [self.model.kern.kern_list[j].variance.value.copy() for j in range(len(self.pitches))]
+        smean, svar = self.model.predict_s(x.copy())
+        return variance, smean, svar
+
+    def stream(self, chunks, fs=None, window_size=2001, maxiter=1000, disp=0):
+        """
+        Source separation on a stream of audio. "chunks" is any iterator of arrays with consecutive samples of the
+        mixture. Windows (with 50% overlap) are optimized as soon as enough samples have arrived, and the finished
+        overlap-added part of the estimated sources is yielded as (x, [[mean, var], ...]), one pair per source.
+        The output lags the input by at most one window (window_size samples), and only one window plus one chunk
+        are kept in memory. When the stream ends, the samples after the last full window (all of them if the stream
+        is shorter than a window) are fitted in a final window padded with zeros, and the output is trimmed to the
+        samples received. The learned variances of each window are appended to self.stream_var.
+        """
+        if fs is None:
+            fs = self.test_data.fs
+        ws = window_size
+        hop = (ws - 1) // 2
+        nsources = len(self.pitches)
+
+        self.stream_var = []
+        buff = np.zeros((0, 1))
+        offset = 0  # index of the first sample in the buffer
+        adder = window_overlap.OverlapAdder(ws=ws, nsources=nsources)
+
+        for chunk in chunks:
+            buff = np.vstack([buff, np.asarray(chunk, dtype=float).reshape(-1, 1)])
+
+            while buff.shape[0] >= ws:
+                # the first half of the window is finished once it is merged with the previous one
+                yield self.stream_window(adder, buff[0:ws].copy(), offset, fs, maxiter=maxiter, disp=disp)
+                buff = buff[hop:]
+                offset += hop
+
+        # samples not covered by the last window yet, fitted in a final window padded with zeros
+        nsamples = offset + buff.shape[0]
+        if buff.shape[0] > (ws - hop if adder.nwin > 0 else 0):
+            y = np.vstack([buff, np.zeros((ws - buff.shape[0], 1))])
+            yield self.stream_window(adder, y, offset, fs, maxiter=maxiter, disp=disp, n=nsamples)
+
+        # second half of the last window is not overlapped
+        adder.finish()
+        if adder.nfinished > adder.npopped:
+            yield self.stream_output(adder, fs, n=nsamples)
+
+    def stream_window(self, adder, y, offset, fs, maxiter=1000, disp=0, n=None):
+        """Fit the window "y" of a stream starting at sample "offset", add its sources and return the finished part"""
+        x = (offset + np.arange(y.shape[0]).reshape(-1, 1)) / float(fs)
+        z = gpitch.init_liv(x=x, y=y, num_sources=1)[0][0][0]
+
+        variance, smean, svar = self.fit_window(x=x, y=y, z=z, maxiter=maxiter, disp=disp)
+        self.stream_var.append(variance)
+        adder.add(mean=smean, var=svar)
+        return self.stream_output(adder, fs, n=n)
+
+    @staticmethod
+    def stream_output(adder, fs, n=None):
+        """finished samples of an OverlapAdder as (x, [[mean, var], ...]), without those from sample n on"""
+        index, mean, var = adder.pop()
+        if n is not None:
+            mean, var = mean[0:max(n - index, 0)], var[0:max(n - index, 0)]
+        x = (index + np.arange(mean.shape[0]).reshape(-1, 1)) / float(fs)
+        return x, [[mean[:, [k]], var[:, [k]]] for k in range(mean.shape[1])]
 
     def save(self):
         # save results
@@ -339,44 +469,24 @@ class SoSp:
         return mean, var
 
     def predict_s(self):
-        m1, m2, m3 = [], [], []
-        for i in range(len(self.smean)):
-            m1.append(self.smean[i][0])
-            m2.append(self.smean[i][1])
-            m3.append(self.smean[i][2])
-        # m1 = np.asarray(m1).reshape(-1, 1)
-        # m2 = np.asarray(m2).reshape(-1, 1)
-        # m3 = np.asarray(m3).reshape(-1, 1)
         ws_aux = 2001
         n_aux = self.test_data.x.size
-        m1 = window_overlap.merged_mean(y=m1, ws=ws_aux, n=n_aux)
-        m2 = window_overlap.merged_mean(y=m2, ws=ws_aux, n=n_aux)
-        m3 = window_overlap.merged_mean(y=m3, ws=ws_aux, n=n_aux)
+        nsources = len(self.smean[0])
 
-        v1, v2, v3 = [], [], []
+        # merge the windows of all sources at once
+        adder = window_overlap.OverlapAdder(ws=ws_aux, n=n_aux, nsources=nsources)
         for i in range(len(self.smean)):
-            v1.append(self.svar[i][0])
-            v2.append(self.svar[i][1])
-            v3.append(self.svar[i][2])
-        # v1 = np.asarray(v1).reshape(-1, 1)
-        # v2 = np.asarray(v2).reshape(-1, 1)
-        # v3 = np.asarray(v3).reshape(-1, 1)
-        v1 = window_overlap.merged_variance(y=v1, ws=ws_aux, n=n_aux)
-        v2 = window_overlap.merged_variance(y=v2, ws=ws_aux, n=n_aux)
-        v3 = window_overlap.merged_variance(y=v3, ws=ws_aux, n=n_aux)
-
-        if m1.size == 224001:
-            m1 = m1[0:-1].reshape(-1, 1)
-            m2 = m2[0:-1].reshape(-1, 1)
-            m3 = m3[0:-1].reshape(-1, 1)
-
-            v1 = v1[0:-1].reshape(-1, 1)
-            v2 = v2[0:-1].reshape(-1, 1)
-            v3 = v3[0:-1].reshape(-1, 1)
+            adder.add(mean=self.smean[i], var=self.svar[i])
+        adder.finish()
+
+        if n_aux == 224001:
+            n_aux -= 1
             self.test_data.x = self.test_data.x[0:-1].reshape(-1, 1)
             self.test_data.y = self.test_data.y[0:-1].reshape(-1, 1)
 
-        self.esource = [[m1, v1], [m2, v2], [m3, v3]]  # estimated sources
+        # estimated sources
+        self.esource = [[adder.mean[0:n_aux, k].reshape(-1, 1), adder.var[0:n_aux, k].reshape(-1, 1)]
+                        for k in range(nsources)]
 
     def plot_results(self, figsize=(16, 3*4)):
 
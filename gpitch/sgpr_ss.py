@@ -3,6 +3,8 @@ import tensorflow as tf
 from gpflow.param import AutoFlow, DataHolder
 from gpflow import settings
 import numpy as np
+import toeplitz
+from matern12_spectral_mixture import PitchKernelBank, pad_partials
 
 float_type = settings.dtypes.float_type
 
@@ -11,10 +13,10 @@ class SGPRSS(gpflow.sgpr.SGPR):
     """
     Sparse Gaussian process regression for source separation
     """
-    def __init__(self, X, Y, kern, Z, mean_function=None, reg=False):
+    def __init__(self, X, Y, kern, Z, mean_function=None, reg=False, sparse_source=False):
 
-        # if regularization is true
-        if reg:
+        # if regularization is true (a PitchKernelBank already holds the variances in a vector)
+        if reg and not isinstance(kern, PitchKernelBank):
             # introduce vector (ParamList) with the variances of every pitch kernel 
             D = len(kern.kern_list)
             var_list = []
@@ -24,7 +26,40 @@ class SGPRSS(gpflow.sgpr.SGPR):
 
         gpflow.sgpr.SGPR.__init__(self, X=X, Y=Y, kern=kern, Z=Z, mean_function=mean_function)
         self.Z = DataHolder(Z, on_shape_change='pass')
+        self.Zmask = DataHolder(np.ones(Z.shape[0]), on_shape_change='pass')  # zero for padded inducing points
         self.reg = reg
+        self.sparse_source = sparse_source  # predict_s through the inducing points (see build_predict_source_sparse)
+
+    def set_inducing(self, z, buckets=None):
+        """
+        Set the inducing inputs of a new window. With "buckets" (see bucket_sizes) they are padded up to the smallest
+        bucket that holds them and the padding is masked out, so that every window of a bucket has the same Z shape.
+        """
+        size = z.shape[0] if buckets is None else bucket_size(z.shape[0], buckets)
+        zpad, mask = pad_inducing(z, size)
+        self.Z = zpad.copy()
+        self.Zmask = mask
+
+    def build_inducing(self):
+        """Kuf and the Cholesky factor of Kuu, with the padded inducing points masked out (see mask_inducing)"""
+        num_inducing = tf.shape(self.Z)[0]
+        Kuf = self.kern.K(self.Z, self.X)
+        Kuu = self.kern.K(self.Z) + tf.eye(num_inducing, dtype=float_type) * settings.numerics.jitter_level
+        Kuu, Kuf = mask_inducing(Kuu, Kuf, self.Zmask)
+        return Kuf, tf.cholesky(Kuu)
+
+    def build_factors(self):
+        """Cholesky factors of Kuu (L) and of B = I + A A^T (LB), and c = LB^-1 A (Y - mean) / sigma"""
+        num_inducing = tf.shape(self.Z)[0]
+        err = self.Y - self.mean_function(self.X)
+        Kuf, L = self.build_inducing()
+        sigma = tf.sqrt(self.likelihood.variance)
+        A = tf.matrix_triangular_solve(L, Kuf, lower=True) / sigma
+        B = tf.matmul(A, A, transpose_b=True) + tf.eye(num_inducing, dtype=float_type)
+        LB = tf.cholesky(B)
+        Aerr = tf.matmul(A, err)
+        c = tf.matrix_triangular_solve(LB, Aerr, lower=True) / sigma
+        return L, LB, c
 
     def build_likelihood(self):
         """
@@ -39,9 +74,7 @@ class SGPRSS(gpflow.sgpr.SGPR):
 
         err = self.Y - self.mean_function(self.X)
         Kdiag = self.kern.Kdiag(self.X)
-        Kuf = self.kern.K(self.Z, self.X)
-        Kuu = self.kern.K(self.Z) + tf.eye(num_inducing, dtype=float_type) * settings.numerics.jitter_level
-        L = tf.cholesky(Kuu)
+        Kuf, L = self.build_inducing()
         sigma = tf.sqrt(self.likelihood.variance)
 
         # Compute intermediate matrices
@@ -64,12 +97,31 @@ class SGPRSS(gpflow.sgpr.SGPR):
         if self.reg:
             # add regularization
             beta = 1000.
-            regularization = -beta * reduce(tf.add, map(tf.abs, self.kern.var_vector))  # L-1 norm
+            if isinstance(self.kern, PitchKernelBank):
+                regularization = -beta * tf.reduce_sum(tf.abs(self.kern.variance))  # L-1 norm
+            else:
+                regularization = -beta * reduce(tf.add, map(tf.abs, self.kern.var_vector))  # L-1 norm
             return bound + regularization
 
         else:
             return bound
 
+    def build_predict(self, Xnew, full_cov=False):
+        """Predictive distribution of the mixture (SGPR), with the padded inducing points masked out"""
+        L, LB, c = self.build_factors()
+        Kus = tf.expand_dims(self.Zmask, -1) * self.kern.K(self.Z, Xnew)
+        tmp1 = tf.matrix_triangular_solve(L, Kus, lower=True)
+        tmp2 = tf.matrix_triangular_solve(LB, tmp1, lower=True)
+        mean = tf.matmul(tmp2, c, transpose_a=True)
+        if full_cov:
+            var = self.kern.K(Xnew) + tf.matmul(tmp2, tmp2, transpose_a=True) - tf.matmul(tmp1, tmp1, transpose_a=True)
+            shape = tf.stack([1, 1, tf.shape(self.Y)[1]])
+            var = tf.tile(tf.expand_dims(var, 2), shape)
+        else:
+            var = self.kern.Kdiag(Xnew) + tf.reduce_sum(tf.square(tmp2), 0) - tf.reduce_sum(tf.square(tmp1), 0)
+            var = tf.tile(tf.expand_dims(var, 1), tf.stack([1, tf.shape(self.Y)[1]]))
+        return mean + self.mean_function(Xnew), var
+
     def build_predict_source(self, Xnew, full_cov=False):
         """
         Xnew is a data matrix, point at which we want to predict
@@ -105,10 +157,427 @@ class SGPRSS(gpflow.sgpr.SGPR):
             var.append(svar)
         return mean, var
 
+    def build_predict_source_sparse(self, Xnew, full_cov=False):
+        """
+        Xnew is a data matrix, point at which we want to predict
+
+        This method computes p(source* | Y ) like build_predict_source, but through the inducing points, with the
+        same quantities (Kuf, L, LB) used by the bound. The cross covariance between the mixture at Z and source i
+        at Xnew is Ki(Z, Xnew), so every source follows the SGPR predictive equations with Kus replaced by it. The
+        cost is O(NM^2) and no N x N matrix is formed.
+        """
+        L, LB, c = self.build_factors()
+
+        mean = []
+        var = []
+        for kern in self.kern.kern_list:
+            Kus = tf.expand_dims(self.Zmask, -1) * kern.K(self.Z, Xnew)
+            tmp1 = tf.matrix_triangular_solve(L, Kus, lower=True)
+            tmp2 = tf.matrix_triangular_solve(LB, tmp1, lower=True)
+            smean = tf.matmul(tmp2, c, transpose_a=True) + self.mean_function(Xnew)
+            if full_cov:
+                svar = kern.K(Xnew) + tf.matmul(tmp2, tmp2, transpose_a=True) - tf.matmul(tmp1, tmp1, transpose_a=True)
+                shape = tf.stack([1, 1, tf.shape(self.Y)[1]])
+                svar = tf.tile(tf.expand_dims(svar, 2), shape)
+            else:
+                svar = kern.Kdiag(Xnew) + tf.reduce_sum(tf.square(tmp2), 0) - tf.reduce_sum(tf.square(tmp1), 0)
+                svar = tf.tile(tf.reshape(svar, (-1, 1)), [1, tf.shape(self.Y)[1]])
+
+            mean.append(smean)
+            var.append(svar)
+        return mean, var
+
     @AutoFlow((float_type, [None, None]))
     def predict_s(self, Xnew):
         """
         Compute the mean and variance of the sources
-        at the points `Xnew`.
+        at the points `Xnew`. The inducing point posterior is used if self.sparse_source is True (it must be set
+        before the first call, the graph is built once).
         """
+        if self.sparse_source:
+            return self.build_predict_source_sparse(Xnew)
         return self.build_predict_source(Xnew)
+
+    def build_predict_all(self, Xnew, L, LB, c):
+        """
+        Posterior of the mixture and of every source at Xnew from the factors of build_factors. Every Ki(Z, Xnew) and
+        its two triangular solves are computed once: the mixture terms are the sums of the source terms.
+        """
+        mask = tf.expand_dims(self.Zmask, -1)
+        shape = tf.stack([1, tf.shape(self.Y)[1]])
+        smean, svar = [], []
+        mix_tmp1, mix_tmp2, mix_diag = 0., 0., 0.
+        for kern in self.kern.kern_list:
+            tmp1 = tf.matrix_triangular_solve(L, mask * kern.K(self.Z, Xnew), lower=True)
+            tmp2 = tf.matrix_triangular_solve(LB, tmp1, lower=True)
+            kdiag = kern.Kdiag(Xnew)
+            smean.append(tf.matmul(tmp2, c, transpose_a=True) + self.mean_function(Xnew))
+            var = kdiag + tf.reduce_sum(tf.square(tmp2), 0) - tf.reduce_sum(tf.square(tmp1), 0)
+            svar.append(tf.tile(tf.expand_dims(var, 1), shape))
+            mix_tmp1, mix_tmp2, mix_diag = mix_tmp1 + tmp1, mix_tmp2 + tmp2, mix_diag + kdiag
+
+        mean = tf.matmul(mix_tmp2, c, transpose_a=True) + self.mean_function(Xnew)
+        var = mix_diag + tf.reduce_sum(tf.square(mix_tmp2), 0) - tf.reduce_sum(tf.square(mix_tmp1), 0)
+        return mean, tf.tile(tf.expand_dims(var, 1), shape), smean, svar
+
+    @AutoFlow((float_type, [None, None]))
+    def predict_all_fused(self, Xnew):
+        """mean and variance of the mixture and of the sources at Xnew, in one graph evaluation"""
+        L, LB, c = self.build_factors()
+        return self.build_predict_all(Xnew, L, LB, c)
+
+    @AutoFlow()
+    def compute_factors(self):
+        return self.build_factors()
+
+    @AutoFlow((float_type, [None, None]), (float_type, [None, None]), (float_type, [None, None]),
+              (float_type, [None, None]))
+    def predict_all_factors(self, Xnew, L, LB, c):
+        return self.build_predict_all(Xnew, L, LB, c)
+
+    def predict_all(self, Xnew, chunk=None):
+        """
+        Mean and variance of the mixture and of every source at Xnew, like predict_f and predict_s, sharing the
+        factorizations. With "chunk" the factors are computed once and the predictions in blocks of "chunk" points, so
+        memory does not grow with the size of Xnew. Without sparse_source the dense predict_s is used instead.
+        :return: mean, var (N x D), list of source means and list of source variances
+        """
+        if not self.sparse_source:
+            mean, var = self.predict_f(Xnew)
+            smean, svar = self.predict_s(Xnew)
+            return mean, var, smean, svar
+        if chunk is None or Xnew.shape[0] <= chunk:
+            return self.predict_all_fused(Xnew)
+
+        L, LB, c = self.compute_factors()
+        parts = [self.predict_all_factors(Xnew[i:i + chunk], L, LB, c) for i in range(0, Xnew.shape[0], chunk)]
+        nsources = len(parts[0][2])
+        return (np.vstack([p[0] for p in parts]), np.vstack([p[1] for p in parts]),
+                [np.vstack([p[2][k] for p in parts]) for k in range(nsources)],
+                [np.vstack([p[3][k] for p in parts]) for k in range(nsources)])
+
+    @AutoFlow((float_type, [None, None]))
+    def predict_s_dense(self, Xnew):
+        """
+        Compute the mean and variance of the sources at the points `Xnew` with the exact posterior given the
+        hyperparameters (dense N x N Cholesky).
+        """
+        return self.build_predict_source(Xnew)
+
+    def toeplitz_columns(self, nrows=8):
+        """
+        First column of the covariance of every source on the (regular) grid self.X, and of the covariance of the
+        mixture plus noise. Only N kernel evaluations per source are needed. The kernels must be stationary: "nrows"
+        rows of the covariance of every source, spread over the grid, are checked against the Toeplitz matrix of its
+        first column. The Toeplitz methods are standalone utilities, SoSp and AMT predict with predict_all.
+        """
+        x = self.X.value
+        if not toeplitz.is_regular(x):
+            raise ValueError("the Toeplitz solvers require equally spaced inputs")
+        if not isinstance(self.mean_function, gpflow.mean_functions.Zero):
+            raise ValueError("the Toeplitz solvers assume a zero mean function")
+
+        cols = [k.compute_K(x, x[0:1]).reshape(-1, ) for k in self.kern.kern_list]
+        index = np.unique(np.linspace(0, x.shape[0] - 1, nrows).astype(int))
+        for i, k in enumerate(self.kern.kern_list):
+            if not toeplitz.is_toeplitz(cols[i], k.compute_K(x[index], x), index):
+                raise ValueError("the Toeplitz solvers require stationary kernels, the covariance of source " +
+                                 str(i) + " is not Toeplitz on self.X")
+        col = np.sum(cols, 0)
+        col[0] += self.likelihood.variance.value
+        return cols, col
+
+    def log_marginal_toeplitz(self):
+        """Exact log marginal likelihood of the mixture, with Toeplitz solvers instead of a dense Cholesky"""
+        col = self.toeplitz_columns()[1]
+        y = self.Y.value
+        alpha = toeplitz.solve(col, y)
+        n, d = y.shape
+        return -0.5 * np.sum(y * alpha) - 0.5 * d * toeplitz.logdet(col) - 0.5 * n * d * np.log(2 * np.pi)
+
+    def predict_s_toeplitz(self, method='pcg', variance=True, block=256):
+        """
+        Mean and variance of the sources at the training inputs, like predict_s(self.X), for stationary kernels on a
+        regular grid. The mixture covariance is Toeplitz: solves use Levinson recursion or FFT preconditioned
+        conjugate gradients ('pcg') and the variances the Gohberg-Semencul formula, without N x N matrices.
+        """
+        cols, col = self.toeplitz_columns()
+        y = self.Y.value
+        alpha = toeplitz.solve(col, y, method=method)
+
+        mean, var = [], []
+        for c in cols:
+            mean.append(toeplitz.toeplitz_matvec(c, alpha))
+            if variance:
+                svar = c[0] - toeplitz.quad_diag(col, c, block=block)
+                var.append(np.tile(svar.reshape(-1, 1), [1, y.shape[1]]))
+            else:
+                var.append(None)
+        return mean, var
+
+
+def pad_inducing(z, size):
+    """
+    Pad the inducing inputs "z" up to "size" points by repeating the last one. Returns the padded inputs and a mask
+    that is one for the original points and zero for the padding.
+    """
+    num_pad = size - z.shape[0]
+    zpad = np.vstack([z, np.repeat(z[-1:], num_pad, axis=0)])
+    mask = np.hstack([np.ones(z.shape[0]), np.zeros(num_pad)])
+    return zpad, mask
+
+
+def bucket_sizes(sizes, num_buckets=4, multiple=8):
+    """
+    A few fixed numbers of inducing points that cover the inducing sets of all windows ("sizes"): the quantiles of
+    the sizes, rounded up to a multiple of "multiple". The largest bucket holds the largest set.
+    """
+    sizes = np.asarray(sizes)
+    quantiles = np.percentile(sizes, np.linspace(100. / num_buckets, 100., num_buckets))
+    buckets = multiple * np.ceil(np.append(quantiles, sizes.max()) / multiple).astype(int)
+    return sorted(set(buckets.tolist()))
+
+
+def bucket_size(size, buckets):
+    """smallest bucket that holds "size" inducing points (size itself if it is larger than every bucket)"""
+    for b in buckets:
+        if b >= size:
+            return b
+    return size
+
+
+def mask_inducing(Kuu, Kuf, mask):
+    """
+    Remove the padded inducing points (mask equal to zero) from the covariances. The rows of Kuf corresponding to the
+    padding are set to zero and its block in Kuu to the identity, which leaves the bound unchanged.
+    """
+    mask_col = tf.expand_dims(mask, -1)
+    mask_row = tf.expand_dims(mask, -2)
+    Kuf = mask_col * Kuf
+    Kuu = mask_col * Kuu * mask_row + tf.matrix_diag(1. - mask)
+    return Kuu, Kuf
+
+
+class BatchSGPRSS(gpflow.model.Model):
+    """
+    Sparse Gaussian process regression for source separation on a batch of windows. The B windows of equal length
+    are stacked in tensors with a leading batch dimension, X and Y have shape B x N x 1, Z has shape B x M x 1.
+    Every window has its own noise variance, and its own variance, lengthscale, energies and frequencies for each
+    pitch kernel (Matern 1/2 spectral mixture), so the free parameters of a window are the same as in SGPRSS. The
+    energies and frequencies are B x P x m parameters, padded up to the largest number of partials m and with the
+    padding masked out as in PitchKernelBank. The objective is the sum of the independent bounds. All windows start
+    from the same initial values, see reset_params.
+    """
+    def __init__(self, X, Y, Z, energy, frequency, lengthscale, Zmask=None, len_fixed=True, reg=False):
+        gpflow.model.Model.__init__(self)
+        nbatch = X.shape[0]
+        self.num_pitches = len(energy)
+
+        if Zmask is None:
+            Zmask = np.ones(Z.shape[0:2])
+
+        self.X = DataHolder(X, on_shape_change='pass')
+        self.Y = DataHolder(Y, on_shape_change='pass')
+        self.Z = DataHolder(Z, on_shape_change='pass')
+        self.Zmask = DataHolder(Zmask, on_shape_change='pass')
+
+        energy_pad, frequency_pad, self.partial_mask = pad_partials(energy, frequency)
+        self.init_values = [energy_pad, frequency_pad, np.asarray(lengthscale, dtype=float).reshape(1, -1)]
+        self.noise_var = gpflow.param.Param(np.ones(nbatch), gpflow.transforms.positive)
+        self.variance = gpflow.param.Param(np.ones((nbatch, self.num_pitches)), gpflow.transforms.positive)
+        self.lengthscales = gpflow.param.Param(np.tile(self.init_values[2], (nbatch, 1)), gpflow.transforms.positive)
+        self.energy = gpflow.param.Param(np.tile(energy_pad, (nbatch, 1, 1)), gpflow.transforms.positive)
+        self.frequency = gpflow.param.Param(np.tile(frequency_pad, (nbatch, 1, 1)), gpflow.transforms.positive)
+        self.lengthscales.fixed = len_fixed
+        self.reg = reg
+
+    def reset_params(self):
+        """Hyperparameters of all windows back to their initial values, before fitting a new batch"""
+        nbatch = self.noise_var.value.shape[0]
+        energy_pad, frequency_pad, init_len = self.init_values
+        self.noise_var = np.ones(nbatch)
+        self.variance = np.ones((nbatch, self.num_pitches))
+        self.lengthscales = np.tile(init_len, (nbatch, 1))
+        self.energy = np.tile(energy_pad, (nbatch, 1, 1))
+        self.frequency = np.tile(frequency_pad, (nbatch, 1, 1))
+
+    def partials(self, b):
+        """Fitted energies and frequencies of window b, lists with one vector per pitch without the padding"""
+        num_partials = np.sum(self.partial_mask, 1).astype(int)
+        energy, frequency = self.energy.value[b], self.frequency.value[b]
+        return ([energy[i, 0:num_partials[i]] for i in range(self.num_pitches)],
+                [frequency[i, 0:num_partials[i]] for i in range(self.num_pitches)])
+
+    def phi_features(self, X, i):
+        """Features of the cosine mixture of pitch i, X is B x N x 1, returns B x N x 2m"""
+        arg = 2. * np.pi * X * tf.expand_dims(self.frequency[:, i, :], 1)
+        sqrt_energy = self.partial_mask[i].reshape(1, 1, -1) * tf.sqrt(tf.expand_dims(self.energy[:, i, :], 1))
+        return tf.concat([sqrt_energy * tf.cos(arg), sqrt_energy * tf.sin(arg)], 2)
+
+    def build_kern(self, X, X2):
+        """Covariance between X (B x N x 1) and X2 (B x M x 1) summed over all pitches, returns B x N x M"""
+        r = tf.abs(X - tf.transpose(X2, [0, 2, 1]))
+        k = 0.
+        for i in range(self.num_pitches):
+            variance = tf.reshape(self.variance[:, i], (-1, 1, 1))
+            lengthscales = tf.reshape(self.lengthscales[:, i], (-1, 1, 1))
+            cos_mix = tf.matmul(self.phi_features(X, i), self.phi_features(X2, i), transpose_b=True)
+            k += variance * tf.exp(-r / lengthscales) * cos_mix
+        return k
+
+    def build_kdiag(self):
+        """Prior variance of every window (same for all points), returns B"""
+        return tf.reduce_sum(self.variance * tf.reduce_sum(self.partial_mask * self.energy, 2), 1)
+
+    def build_bounds(self):
+        """Construct a tensorflow function to compute the bound of every window in the batch, returns B"""
+        num_inducing = tf.shape(self.Z)[1]
+        num_data = tf.cast(tf.shape(self.Y)[1], float_type)
+
+        err = self.Y
+        Kuf = self.build_kern(self.Z, self.X)
+        Kuu = self.build_kern(self.Z, self.Z)
+        Kuu, Kuf = mask_inducing(Kuu, Kuf, self.Zmask)
+        Kuu += tf.eye(num_inducing, dtype=float_type) * settings.numerics.jitter_level
+        L = tf.cholesky(Kuu)
+        noise_var = tf.reshape(self.noise_var, (-1, 1, 1))
+        sigma = tf.sqrt(noise_var)
+
+        # Compute intermediate matrices (batched)
+        A = tf.matrix_triangular_solve(L, Kuf, lower=True) / sigma
+        AAT = tf.matmul(A, A, transpose_b=True)
+        B = AAT + tf.eye(num_inducing, dtype=float_type)
+        LB = tf.cholesky(B)
+        Aerr = tf.matmul(A, err)
+        c = tf.matrix_triangular_solve(LB, Aerr, lower=True) / sigma
+
+        # compute log marginal bound of every window
+        bound = -0.5 * num_data * np.log(2 * np.pi)
+        bound += - tf.reduce_sum(tf.log(tf.matrix_diag_part(LB)), 1)
+        bound -= 0.5 * num_data * tf.log(self.noise_var)
+        bound += -0.5 * tf.reduce_sum(tf.square(err), [1, 2]) / self.noise_var
+        bound += 0.5 * tf.reduce_sum(tf.square(c), [1, 2])
+        bound += -0.5 * num_data * self.build_kdiag() / self.noise_var
+        bound += 0.5 * tf.reduce_sum(tf.matrix_diag_part(AAT), 1)
+
+        if self.reg:
+            # add regularization
+            beta = 1000.
+            bound += -beta * tf.reduce_sum(tf.abs(self.variance), 1)  # L-1 norm
+
+        return bound
+
+    def build_likelihood(self):
+        """The windows are independent, the objective is the sum of their bounds"""
+        return tf.reduce_sum(self.build_bounds())
+
+    @AutoFlow()
+    def compute_bounds(self):
+        """Bound of every window in the batch"""
+        return self.build_bounds()
+
+
+def gram_statistics(Y, Kuf, Kdiag):
+    """
+    Sufficient statistics of a window for the bound of SGPRSSGram, none of them depends on N: G (P x P x M x M) with
+    G[i, j] = Kuf_i Kuf_j^T, g (P x M x D) with g[i] = Kuf_i Y, yy = Y^T Y and trK (P), the traces of Kdiag_i.
+    """
+    G = np.einsum('imn,jkn->ijmk', Kuf, Kuf)
+    g = np.einsum('imn,nd->imd', Kuf, Y)
+    return G, g, np.sum(np.square(Y)), np.sum(Kdiag, 1)
+
+
+class SGPRSSGram(gpflow.model.Model):
+    """
+    Collapsed bound of SGPRSS when only the variances of the pitch kernels and the noise variance are free. The
+    composite kernel is sum_i v_i K_i with fixed unit variance Gram matrices K_i, given as data: Kuf (P x M x N),
+    Kuu (P x M x M) and Kdiag (P x N), see gramcache.GramCache. Every evaluation of the bound is a weighted sum of the
+    Gram matrices, kernels are never evaluated.
+
+    With stats=True the Gram matrices are reduced once per window to the statistics of gram_statistics, and the cost
+    of every evaluation of the bound does not depend on N: O(P^2 M^2 + M^3) instead of O(P M N + N M^2). By default
+    (stats=None) they are used when P M < N, e.g. for source separation with a few pitches, and not for transcription
+    with many pitches.
+    """
+    def __init__(self, Y, Kuf, Kuu, Kdiag, reg=False, stats=None):
+        gpflow.model.Model.__init__(self)
+        num_pitches, num_inducing, num_data = Kuf.shape
+        if stats is None:
+            stats = num_pitches * num_inducing < num_data
+        self.stats = stats
+
+        self.Kuu = DataHolder(Kuu, on_shape_change='pass')
+        if stats:
+            G, g, yy, trK = gram_statistics(Y, Kuf, Kdiag)
+            self.G = DataHolder(G, on_shape_change='pass')
+            self.g = DataHolder(g, on_shape_change='pass')
+            self.yy = DataHolder(np.array(yy), on_shape_change='pass')
+            self.trK = DataHolder(trK, on_shape_change='pass')
+            self.shape = DataHolder(np.array(Y.shape, dtype=float), on_shape_change='pass')  # N and D
+        else:
+            self.Y = DataHolder(Y, on_shape_change='pass')
+            self.Kuf = DataHolder(Kuf, on_shape_change='pass')
+            self.Kdiag = DataHolder(Kdiag, on_shape_change='pass')
+        self.noise_var = gpflow.param.Param(1., gpflow.transforms.positive)
+        self.variance = gpflow.param.Param(np.ones(num_pitches), gpflow.transforms.positive)
+        self.reg = reg
+
+    def set_window(self, Y, Kuf, Kuu, Kdiag):
+        """Data of a new window, hyperparameters back to their initial values"""
+        self.Kuu = Kuu
+        if self.stats:
+            G, g, yy, trK = gram_statistics(Y, Kuf, Kdiag)
+            self.G, self.g, self.yy, self.trK = G, g, np.array(yy), trK
+            self.shape = np.array(Y.shape, dtype=float)
+        else:
+            self.Y, self.Kuf, self.Kdiag = Y, Kuf, Kdiag
+        self.noise_var = 1.
+        self.variance = np.ones(Kuf.shape[0])
+
+    def build_terms(self):
+        """
+        Terms of the bound that depend on the data: number of data and outputs, K_uf K_uf^T, K_uf Y, sum of squares
+        of Y and trace of Kff
+        """
+        if self.stats:
+            KufKfu = tf.tensordot(self.variance, tf.tensordot(self.variance, self.G, 1), 1)
+            KufY = tf.tensordot(self.variance, self.g, 1)
+            return self.shape[0], self.shape[1], KufKfu, KufY, self.yy, tf.reduce_sum(self.variance * self.trK)
+
+        Kuf = tf.tensordot(self.variance, self.Kuf, 1)
+        num_data = tf.cast(tf.shape(self.Y)[0], float_type)
+        output_dim = tf.cast(tf.shape(self.Y)[1], float_type)
+        Kdiag = tf.tensordot(self.variance, self.Kdiag, 1)
+        return (num_data, output_dim, tf.matmul(Kuf, Kuf, transpose_b=True), tf.matmul(Kuf, self.Y),
+                tf.reduce_sum(tf.square(self.Y)), tf.reduce_sum(Kdiag))
+
+    def build_likelihood(self):
+        num_inducing = tf.shape(self.Kuu)[1]
+        num_data, output_dim, KufKfu, KufY, yy, trK = self.build_terms()
+
+        Kuu = tf.tensordot(self.variance, self.Kuu, 1)
+        Kuu += tf.eye(num_inducing, dtype=float_type) * settings.numerics.jitter_level
+        L = tf.cholesky(Kuu)
+
+        # Compute intermediate matrices, AAT = L^-1 Kuf Kfu L^-T / noise_var
+        tmp = tf.matrix_triangular_solve(L, KufKfu, lower=True)
+        AAT = tf.matrix_triangular_solve(L, tf.transpose(tmp), lower=True) / self.noise_var
+        B = AAT + tf.eye(num_inducing, dtype=float_type)
+        LB = tf.cholesky(B)
+        Aerr = tf.matrix_triangular_solve(L, KufY, lower=True) / tf.sqrt(self.noise_var)
+        c = tf.matrix_triangular_solve(LB, Aerr, lower=True) / tf.sqrt(self.noise_var)
+
+        # compute log marginal bound
+        bound = -0.5 * num_data * output_dim * np.log(2 * np.pi)
+        bound += - output_dim * tf.reduce_sum(tf.log(tf.matrix_diag_part(LB)))
+        bound -= 0.5 * num_data * output_dim * tf.log(self.noise_var)
+        bound += -0.5 * yy / self.noise_var
+        bound += 0.5 * tf.reduce_sum(tf.square(c))
+        bound += -0.5 * output_dim * trK / self.noise_var
+        bound += 0.5 * output_dim * tf.reduce_sum(tf.matrix_diag_part(AAT))
+
+        if self.reg:
+            # add regularization
+            beta = 1000.
+            bound += -beta * tf.reduce_sum(tf.abs(self.variance))  # L-1 norm
+        return bound
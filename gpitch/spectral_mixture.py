@@ -0,0 +1,100 @@
+import numpy as np
+import tensorflow as tf
+import gpflow
+from gpflow.param import ParamList
+from gpflow import settings
+
+
+float_type = settings.dtypes.float_type
+np_float_type = np.float32 if float_type is tf.float32 else np.float64
+
+
+def vector_features(X, energy, frequency):
+    """
+    Features [sqrt(e) cos(2 pi f x); sqrt(e) sin(2 pi f x)] of all partials at once (2m x n), from vectors of
+    energies and frequencies (m), as a single outer product of X (n x 1) and the frequencies.
+    """
+    arg = 2. * np.pi * X * tf.reshape(frequency, (1, -1))  # n x m
+    sqrt_energy = tf.reshape(tf.sqrt(energy), (1, -1))
+    phi = tf.concat([sqrt_energy * tf.cos(arg), sqrt_energy * tf.sin(arg)], 1)  # n x 2m
+    return tf.transpose(phi)
+
+
+def stack_partials(values, num_partials):
+    """Vector (m) with the values of a ParamList of scalar parameters, of a vector parameter or of an array"""
+    if isinstance(values, ParamList):
+        return tf.concat([tf.reshape(values[i], [-1]) for i in range(num_partials)], 0)
+    if isinstance(values, (list, tuple, np.ndarray)):
+        return np.asarray(values, dtype=np_float_type).reshape(-1, )
+    return tf.reshape(values, [-1])
+
+
+class SpectralMixture(gpflow.kernels.Kern):
+    """
+    Base class of the spectral mixture kernels
+
+        k(x, x') = scale * sum_i w_i * envelope(r / l_i) * cos(2 pi f_i r),  r = |x - x'|
+
+    evaluated for all partials at once, in one of two modes:
+
+    - 'features': cos(2 pi f (x - x')) = cos(2 pi f x) cos(2 pi f x') + sin(2 pi f x) sin(2 pi f x'), so the sum
+      over partials is the product of two n x 2m feature matrices, times the envelope. Requires one dimensional
+      inputs and a lengthscale shared by all partials. Peak memory is N x M plus the features.
+    - 'fused': a single reduction over a partial axis of an N x M x m tensor, for per-partial lengthscales.
+
+    mode=None picks 'features' whenever it is valid. Subclasses implement partials(), returning the vectors of
+    weights and frequencies and the lengthscales (scalar, vector or None for no envelope), and optionally scale(),
+    envelope() and distance().
+    """
+    shared_lengthscale = True
+
+    def __init__(self, input_dim, mode=None):
+        gpflow.kernels.Kern.__init__(self, input_dim, active_dims=None)
+        if mode not in [None, 'features', 'fused']:
+            raise ValueError("mode must be 'features', 'fused' or None, not " + str(mode))
+        if mode == 'features' and not (input_dim == 1 and self.shared_lengthscale):
+            raise ValueError("features mode requires one dimensional inputs and a shared lengthscale")
+        self.mode = mode
+
+    def partials(self):
+        raise NotImplementedError
+
+    def scale(self):
+        return 1.
+
+    def envelope(self, r):
+        return tf.exp(-r)
+
+    def distance(self, X, X2):
+        # Introduce dummy dimension so we can use broadcasting
+        f = tf.expand_dims(X, 1)  # now N x 1 x D
+        f2 = tf.expand_dims(X2, 0)  # now 1 x M x D
+        return tf.reduce_sum(tf.sqrt(tf.square(f - f2 + 1e-12)), 2)
+
+    def use_features(self):
+        if self.mode is None:
+            return self.input_dim == 1 and self.shared_lengthscale
+        return self.mode == 'features'
+
+    def K(self, X, X2=None, presliced=False):
+        if not presliced:
+            X, X2 = self._slice(X, X2)
+        weights, frequency, lengthscales = self.partials()
+
+        if self.use_features():
+            phi = vector_features(X, weights, frequency)
+            phi2 = phi if X2 is None else vector_features(X2, weights, frequency)
+            k = tf.matmul(phi, phi2, transpose_a=True)
+            if lengthscales is not None:
+                k *= self.envelope(self.distance(X, X if X2 is None else X2) / lengthscales)
+        else:
+            r = tf.expand_dims(self.distance(X, X if X2 is None else X2), 2)  # N x M x 1
+            k = weights * tf.cos(2. * np.pi * frequency * r)
+            if lengthscales is not None:
+                k *= self.envelope(r / lengthscales)
+            k = tf.reduce_sum(k, 2)
+        return self.scale() * k
+
+    def Kdiag(self, X, presliced=False):
+        var = self.scale() * tf.reduce_sum(self.partials()[0])
+        return tf.fill(tf.stack([tf.shape(X)[0]]), tf.squeeze(var))
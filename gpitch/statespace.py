@@ -0,0 +1,194 @@
+"""
+State space (Kalman filter) inference for sums of Matern 1/2 and Matern 3/2 envelopes times cosines. Every partial of
+a pitch kernel is a low order linear time invariant SDE, a pitch is the block diagonal stack of its partials and the
+mixture is the stack of all pitches. Inference is then O(N d^3) in time and linear in N in memory, with the filtered
+moments optionally stored on disk.
+"""
+import numpy as np
+from scipy.linalg import expm, block_diag, cho_factor, cho_solve
+from numpy.lib.format import open_memmap
+import toeplitz
+
+
+class StateSpace:
+    """
+    Stationary LTI model with feedback matrix F, stationary state covariance Pinf and measurement vector H (1 x d).
+    "blocks" are the (start, stop) state indices of every part of a stacked model.
+    """
+    def __init__(self, F, Pinf, H, blocks=None):
+        self.F = np.atleast_2d(F)
+        self.Pinf = np.atleast_2d(Pinf)
+        self.H = np.atleast_2d(H)
+        self.dim = self.F.shape[0]
+        self.blocks = [(0, self.dim)] if blocks is None else blocks
+
+    def discretize(self, dt):
+        """transition matrix and process noise covariance for a time step dt"""
+        A = expm(self.F * dt)
+        Q = self.Pinf - A.dot(self.Pinf).dot(A.T)
+        return A, 0.5 * (Q + Q.T)
+
+    def covariance(self, tau):
+        """covariance k(tau) of the model, for checking"""
+        return np.array([self.H.dot(expm(self.F * t)).dot(self.Pinf).dot(self.H.T)[0, 0] for t in np.ravel(tau)])
+
+    def part(self, i):
+        """measurement vector of part i of a stacked model"""
+        start, stop = self.blocks[i]
+        H = np.zeros_like(self.H)
+        H[:, start:stop] = self.H[:, start:stop]
+        return H
+
+
+def stack(models):
+    """Sum of independent models, as one block diagonal model with one block per model"""
+    blocks, start = [], 0
+    for m in models:
+        blocks.append((start, start + m.dim))
+        start += m.dim
+    return StateSpace(F=block_diag(*[m.F for m in models]),
+                      Pinf=block_diag(*[m.Pinf for m in models]),
+                      H=np.hstack([m.H for m in models]),
+                      blocks=blocks)
+
+
+def rotation(omega):
+    return np.array([[0., -omega], [omega, 0.]])
+
+
+def matern12_cosine(variance, lengthscale, frequency):
+    """variance * exp(-r / lengthscale) * cos(2 pi frequency r), state dimension 2"""
+    lam = 1. / lengthscale
+    F = -lam * np.eye(2) + rotation(2. * np.pi * frequency)
+    return StateSpace(F=F, Pinf=variance * np.eye(2), H=np.array([[1., 0.]]))
+
+
+def matern32_cosine(variance, lengthscale, frequency):
+    """variance * (1 + sqrt(3) r / lengthscale) exp(-sqrt(3) r / lengthscale) * cos(2 pi frequency r), dimension 4"""
+    lam = np.sqrt(3.) / lengthscale
+    Fm = np.array([[0., 1.], [-lam**2, -2. * lam]])
+    Pm = np.diag([variance, lam**2 * variance])
+    F = np.kron(Fm, np.eye(2)) + np.kron(np.eye(2), rotation(2. * np.pi * frequency))
+    return StateSpace(F=F, Pinf=np.kron(Pm, np.eye(2)), H=np.kron(np.array([[1., 0.]]), np.array([[1., 0.]])))
+
+
+def values(param, num):
+    """values of a ParamList of scalar parameters, of a vector parameter or of an array, as a vector"""
+    if hasattr(param, 'value'):
+        return np.asarray(param.value, dtype=float).reshape(-1, )
+    try:
+        return np.array([np.asarray(param[i].value).reshape(-1, )[0] for i in range(num)])
+    except AttributeError:
+        return np.asarray(param, dtype=float).reshape(-1, )
+
+
+def from_kernel(kern):
+    """
+    State space model of a pitch kernel: MercerMatern12sm, Matern12sm and PitchView (Matern 1/2 envelope) or Matern32sm
+    and Matern32sml (Matern 3/2 envelope), one block per partial.
+    """
+    name = type(kern).__name__
+    m = kern.num_partials
+    frequency = values(kern.frequency, m)
+
+    if name in ['MercerMatern12sm', 'Matern12sm', 'PitchView']:
+        energy = kern.variance.value * values(kern.energy, m)
+        lengthscale = np.asarray(kern.lengthscales.value).reshape(-1, )[0] * np.ones(m)
+        partial = matern12_cosine
+    elif name in ['Matern32sm', 'Matern32sml']:
+        energy = values(kern.variance, m)
+        lengthscale = values(kern.lengthscales, m) * np.ones(m)
+        partial = matern32_cosine
+    else:
+        raise ValueError("no state space representation for kernel " + name)
+
+    return stack([partial(energy[i], lengthscale[i], frequency[i]) for i in range(m)])
+
+
+def from_kernels(kern_list):
+    """State space model of a sum of pitch kernels, with one block per pitch"""
+    return stack([from_kernel(k) for k in kern_list])
+
+
+def kalman_filter(model, y, noise_var, dt, filename=None):
+    """
+    Kalman filter for y (N) observed with noise variance noise_var every dt. Returns the log marginal likelihood and
+    the filtered means (N x d) and covariances (N x d x d), as .npy memory maps if a filename is given.
+    """
+    y = np.asarray(y, dtype=float).reshape(-1, )
+    n, d = y.size, model.dim
+    A, Q = model.discretize(dt)
+    H = model.H.reshape(-1, )
+
+    if filename is None:
+        mf, Pf = np.zeros((n, d)), np.zeros((n, d, d))
+    else:
+        mf = open_memmap(filename + '_mean.npy', mode='w+', dtype=float, shape=(n, d))
+        Pf = open_memmap(filename + '_cov.npy', mode='w+', dtype=float, shape=(n, d, d))
+
+    m, P = np.zeros(d), model.Pinf.copy()
+    loglik = 0.
+    for k in range(n):
+        if k > 0:
+            m = A.dot(m)
+            P = A.dot(P).dot(A.T) + Q
+
+        # update with a scalar observation
+        PH = P.dot(H)
+        S = H.dot(PH) + noise_var
+        v = y[k] - H.dot(m)
+        gain = PH / S
+        m = m + gain * v
+        P = P - np.outer(gain, PH)
+        P = 0.5 * (P + P.T)
+        loglik -= 0.5 * (np.log(2. * np.pi * S) + v**2 / S)
+
+        mf[k], Pf[k] = m, P
+    return loglik, mf, Pf
+
+
+def rts_smoother(model, mf, Pf, dt):
+    """
+    Rauch-Tung-Striebel smoother. Returns the posterior mean and variance (N x 1) of every block of the model
+    (every source), the smoothed states are not stored.
+    """
+    n = mf.shape[0]
+    A, Q = model.discretize(dt)
+    Hs = [model.part(i).reshape(-1, ) for i in range(len(model.blocks))]
+    mean = [np.zeros((n, 1)) for h in Hs]
+    var = [np.zeros((n, 1)) for h in Hs]
+
+    ms, Ps = np.array(mf[n - 1]), np.array(Pf[n - 1])
+    for k in range(n - 1, -1, -1):
+        if k < n - 1:
+            m, P = np.array(mf[k]), np.array(Pf[k])
+            mp = A.dot(m)
+            Pp = A.dot(P).dot(A.T) + Q
+            G = cho_solve(cho_factor(Pp), A.dot(P)).T
+            ms = m + G.dot(ms - mp)
+            Ps = P + G.dot(Ps - Pp).dot(G.T)
+            Ps = 0.5 * (Ps + Ps.T)
+        for i, h in enumerate(Hs):
+            mean[i][k] = h.dot(ms)
+            var[i][k] = h.dot(Ps).dot(h)
+    return mean, var
+
+
+def separate(kern_list, x, y, noise_var, filename=None):
+    """
+    Source separation with the state space backend, on a whole (equally spaced) recording without windowing.
+    :param kern_list: pitch kernels
+    :param x: time of every sample (N x 1)
+    :param y: mixture (N x 1)
+    :param noise_var: observation noise variance
+    :param filename: prefix of .npy files where the filtered moments are stored, if given
+    :return: log marginal likelihood, list of source means and list of source variances (N x 1 each)
+    """
+    x = np.asarray(x).reshape(-1, )
+    if not toeplitz.is_regular(x):
+        raise ValueError("the state space backend requires equally spaced inputs")
+    dt = x[1] - x[0]
+    model = from_kernels(kern_list)
+    loglik, mf, Pf = kalman_filter(model, y, noise_var=noise_var, dt=dt, filename=filename)
+    mean, var = rts_smoother(model, mf, Pf, dt=dt)
+    return loglik, mean, var
@@ -0,0 +1,167 @@
+"""
+Solvers for symmetric positive definite Toeplitz matrices, given by their first column. The covariance of a
+stationary kernel evaluated on a regular grid (uniformly sampled audio) is Toeplitz, so it is enough to evaluate
+the first row of the kernel instead of the full N x N matrix.
+"""
+import numpy as np
+from scipy.linalg import solve_toeplitz
+
+
+def is_regular(x, rtol=1e-6):
+    """True if the inputs x (N x 1) are equally spaced"""
+    x = np.asarray(x).reshape(-1, )
+    if x.size < 3:
+        return True
+    dx = np.diff(x)
+    return np.all(np.abs(dx - dx[0]) <= rtol * np.abs(dx[0]))
+
+
+def is_toeplitz(col, rows, index, rtol=1e-6):
+    """
+    True if the rows "rows" (S x N) of a covariance matrix, at the row indices "index", agree with the symmetric
+    Toeplitz matrix of first column col: K[i, i+j] == K[i, i-j] == col[j]. A cheap test of the stationarity of a
+    kernel on a grid, from a few rows instead of the full matrix.
+    """
+    col = np.asarray(col).reshape(-1, )
+    rows = np.asarray(rows).reshape(len(index), -1)
+    n = col.size
+    atol = rtol * np.max(np.abs(col))
+    for i, row in zip(index, rows):
+        expected = np.hstack([col[i:0:-1], col[0:n - i]])
+        if not np.all(np.abs(row - expected) <= atol):
+            return False
+    return True
+
+
+def toeplitz_matvec(col, v, row=None):
+    """
+    Product T v of a Toeplitz matrix (first column col, first row row, symmetric if row is None) and a vector or
+    matrix v (N or N x B), through its embedding in a 2N circulant matrix, in O(N log N) per column.
+    """
+    col = np.asarray(col).reshape(-1, )
+    row = col if row is None else np.asarray(row).reshape(-1, )
+    n = col.size
+    circ = np.hstack([col, [0.], row[:0:-1]])
+
+    v = np.asarray(v)
+    vec = v.ndim == 1
+    v = v.reshape(n, -1)
+    fcirc = np.fft.rfft(circ).reshape(-1, 1)
+    out = np.fft.irfft(fcirc * np.fft.rfft(v, n=2*n, axis=0), n=2*n, axis=0)[0:n]
+    return out.reshape(-1, ) if vec else out
+
+
+def circulant_preconditioner(col):
+    """Eigenvalues of the optimal (T. Chan) circulant approximation of a symmetric Toeplitz matrix"""
+    col = np.asarray(col).reshape(-1, )
+    n = col.size
+    j = np.arange(n)
+    c = ((n - j) * col + j * np.hstack([[0.], col[:0:-1]])) / n
+    eig = np.fft.fft(c).real
+    return np.maximum(eig, 1e-10 * np.abs(col[0]))
+
+
+def pcg(col, b, tol=1e-8, maxiter=None, precond=True):
+    """
+    Solve T x = b by conjugate gradients, with T symmetric positive definite Toeplitz. Every iteration is one FFT
+    matrix vector product, the circulant preconditioner is applied with one more FFT pair.
+    :return: solution and number of iterations
+    """
+    b = np.asarray(b, dtype=float)
+    shape = b.shape
+    b = b.reshape(-1, 1) if b.ndim == 1 else b
+    if maxiter is None:
+        maxiter = b.shape[0]
+    eig = circulant_preconditioner(col) if precond else None
+
+    def minv(r):
+        if eig is None:
+            return r
+        return np.fft.ifft(np.fft.fft(r, axis=0) / eig.reshape(-1, 1), axis=0).real
+
+    x = np.zeros_like(b)
+    r = b.copy()
+    z = minv(r)
+    p = z.copy()
+    rz = np.sum(r * z, 0)
+    bnorm = np.maximum(np.sqrt(np.sum(b**2, 0)), 1e-300)
+
+    niter = 0
+    for niter in range(1, maxiter + 1):
+        Tp = toeplitz_matvec(col, p)
+        alpha = rz / np.sum(p * Tp, 0)
+        x += alpha * p
+        r -= alpha * Tp
+        if np.all(np.sqrt(np.sum(r**2, 0)) <= tol * bnorm):
+            break
+        z = minv(r)
+        rz_new = np.sum(r * z, 0)
+        p = z + (rz_new / rz) * p
+        rz = rz_new
+    return x.reshape(shape), niter
+
+
+def solve(col, b, method='levinson', tol=1e-8, maxiter=None):
+    """Solve T x = b, by Levinson recursion (exact, O(N^2)) or preconditioned conjugate gradients ('pcg')"""
+    if method == 'levinson':
+        return solve_toeplitz(np.asarray(col).reshape(-1, ), b)
+    elif method == 'pcg':
+        return pcg(col, b, tol=tol, maxiter=maxiter)[0]
+    raise ValueError("method must be 'levinson' or 'pcg', not " + str(method))
+
+
+def logdet(col):
+    """Log determinant of a symmetric positive definite Toeplitz matrix, by Durbin recursion in O(N^2)"""
+    col = np.asarray(col, dtype=float).reshape(-1, )
+    n = col.size
+    a = np.zeros(n)  # coefficients of the linear predictor
+    err = col[0]
+    out = np.log(err)
+    for k in range(1, n):
+        kappa = (col[k] - np.dot(a[0:k-1], col[k-1:0:-1])) / err
+        if k > 1:
+            a[0:k-1] = a[0:k-1] - kappa * a[k-2::-1]
+        a[k-1] = kappa
+        err *= (1. - kappa**2)
+        out += np.log(err)
+    return out
+
+
+def inverse_generators(col):
+    """
+    Gohberg-Semencul representation of the inverse of a symmetric Toeplitz matrix,
+
+        T^-1 = (L(x) L(x)^T - L(Zy) L(Zy)^T) / x[0]
+
+    with x = T^-1 e_1, y = T^-1 e_N (x reversed), L(v) the lower triangular Toeplitz matrix with first column v and
+    Z the down shift. Returns x[0], x and Zy.
+    """
+    col = np.asarray(col, dtype=float).reshape(-1, )
+    e1 = np.zeros(col.size)
+    e1[0] = 1.
+    x = solve_toeplitz(col, e1)
+    zy = np.hstack([[0.], x[::-1][0:-1]])
+    return x[0], x, zy
+
+
+def quad_diag(col, acol, block=256):
+    """
+    Diagonal of A T^-1 A, with T and A symmetric Toeplitz matrices given by their first columns, computed in blocks of
+    columns of A with the Gohberg-Semencul formula. O(N^2 log N) time and O(N block) memory, the N x N matrices are
+    never formed.
+    """
+    col = np.asarray(col, dtype=float).reshape(-1, )
+    acol = np.asarray(acol, dtype=float).reshape(-1, )
+    n = col.size
+    x0, x, zy = inverse_generators(col)
+    zeros = np.zeros(n)
+
+    out = np.zeros(n)
+    idx = np.arange(n).reshape(-1, 1)
+    for start in range(0, n, block):
+        cols = np.arange(start, min(start + block, n)).reshape(1, -1)
+        A = acol[np.abs(idx - cols)]  # block of columns of A
+        P = toeplitz_matvec(np.hstack([x[0:1], zeros[1:]]), A, row=x)  # L(x)^T A
+        Q = toeplitz_matvec(zeros, A, row=zy)  # L(Zy)^T A
+        out[start:start + A.shape[1]] = (np.sum(P**2, 0) - np.sum(Q**2, 0)) / x0
+    return out
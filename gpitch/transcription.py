@@ -5,14 +5,19 @@ import gpitch
 import matplotlib.pyplot as plt
 from scipy import fftpack
 from gpitch.audio import Audio
+from gpitch.windowopt import WindowOptimizer
 
 
-class AMT:
+class AMT(WindowOptimizer):
     """
     Automatic music transcription class
     """
+    scale = 20.  # see windowopt.WindowOptimizer
+    len_fixed = False
+    predict_sources = False
+
     def __init__(self, pitches=None, nsec=1, test_filename=None, window_size=2001, gpu='0', reg=False, load=True,
-                 overlap=False):
+                 overlap=False, vectorized=False, bank=False, buckets=None):
 
         # define location of files to use
         self.kernel_path = 'c4dm-04/alvarado/results/sampling_covariance/maps/rectified/'
@@ -45,6 +50,13 @@ class AMT:
         self.var = []
         self.smean = []
         self.svar = []
+        self.niter = []
+        self.warm = []
+        self.active = []
+        self.stop_reason = []
+        self.opt_time = []
+        self.opt_shape = []
+        self.opt_bound = []
         self.matrix_var = []
         self.matrix_len = []
 
@@ -61,6 +73,10 @@ class AMT:
             self.matrix_len = np.zeros((nrow, ncol))
 
         # initialize kernels
+        self.vectorized = vectorized  # partials of each pitch kernel in vector parameters
+        self.bank = bank  # model kernel as one PitchKernelBank instead of a sum of pitch kernels
+        self.num_buckets = buckets  # pad the inducing sets up to this many fixed sizes (see init_buckets)
+        self.buckets = None
         self.init_kernel(load=load)
 
         # initialize regression model
@@ -224,7 +240,8 @@ class AMT:
                                                               lengthscale=self.params[0],
                                                               energy=self.params[1],
                                                               frequency=self.params[2],
-                                                              len_fixed=False)
+                                                              len_fixed=False,
+                                                              vectorized=self.vectorized)
 
     def init_inducing(self):
         nwin = len(self.test_data.X)
@@ -242,18 +259,27 @@ class AMT:
         self.init_inducing()  # init inducing points
 
         # init model kernel
-        kern_model = np.sum(self.kern_pitches)
+        if self.bank:
+            kern_model = gpitch.init_kernels.init_kern_bank(lengthscale=self.params[0],
+                                                            energy=self.params[1],
+                                                            frequency=self.params[2],
+                                                            len_fixed=False)
+        else:
+            kern_model = np.sum(self.kern_pitches)
 
         # init gp model
         x_init = self.test_data.X[0].copy()
         y_init = self.test_data.Y[0].copy()
         z_init = self.inducing[0][0].copy()
         self.model = gpitch.sgpr_ss.SGPRSS(X=x_init, Y=y_init, kern=kern_model, Z=z_init, reg=reg)
+        if self.num_buckets is not None:
+            self.init_buckets(num_buckets=self.num_buckets)
+            self.model.set_inducing(z_init, buckets=self.buckets)
 
     def reset_model(self, x, y, z):
         self.model.X = x.copy()
         self.model.Y = 20.*y.copy()
-        self.model.Z = z.copy()
+        self.model.set_inducing(z, buckets=self.buckets)
         self.model.likelihood.variance = 1.
 
         for i in range(len(self.pitches)):
@@ -262,40 +288,61 @@ class AMT:
             self.model.kern.kern_list[i].variance = 1.
             self.model.kern.kern_list[i].lengthscales = self.params[0][i].copy()
 
-    def optimize(self, maxiter, disp=1, nwin=None):
-
-        self.mean = []
-        self.var = []
-        self.smean = []
-        self.svar = []
-
-        if nwin is None:
-            nwin = len(self.test_data.Y)
-
-        for i in range(nwin):
-
-            # reset model
-            self.reset_model(x=self.test_data.X[i],
-                             y=self.test_data.Y[i],
-                             z=self.inducing[0][i])
-
-            # optimize window
-            self.model.optimize(disp=disp, maxiter=maxiter)
-
-            # save learned params
-            for j in range(len(self.pitches)):
-                # self.matrix_var[j, i] = self.model.kern.kern_list[j].kern_list[0].variance.value.copy()
-                self.matrix_var[j, i] = self.model.kern.kern_list[j].variance.value.copy()
-
-            # # predict mixture function
-            # mean, var = self.model.predict_f(self.test_data.X[i].copy())
-            # self.mean.append(mean)
-            # self.var.append(var)
-            #
-            # # predict sources
-            # smean, svar = self.model.predict_s(self.test_data.X[i].copy())
-            # self.smean.append(smean)
-            # self.svar.append(svar)
+    def window_state(self):
+        """Current noise variance, and variance and lengthscale of every pitch kernel"""
+        variance = [self.model.kern.kern_list[i].variance.value.copy() for i in range(len(self.pitches))]
+        lengthscale = [self.model.kern.kern_list[i].lengthscales.value.copy() for i in range(len(self.pitches))]
+        return [self.model.likelihood.variance.value.copy(), variance, lengthscale]
+
+    def warm_model(self, state, blend=0.):
+        """
+        Start the current window from the optimum "state" of the previous one. With blend=0 the previous optimum is
+        used as it is, with blend=1 the default initialization is recovered.
+        """
+        self.model.likelihood.variance = (1. - blend)*state[0] + blend*1.
+        for i in range(len(self.pitches)):
+            self.model.kern.kern_list[i].variance = (1. - blend)*state[1][i] + blend*1.
+            self.model.kern.kern_list[i].lengthscales = (1. - blend)*state[2][i] + blend*self.params[0][i]
+
+    def skip_window(self, i):
+        """Fill a silent window with zero pitch variances and the initial lengthscales"""
+        self.matrix_var[:, i] = 0.
+        self.matrix_len[:, i] = np.asarray(self.params[0], dtype=float).reshape(-1, )
+        self.niter.append(0)
+        self.warm.append(False)
+        self.stop_reason.append('skipped')
+
+    def save_window(self, i):
+        """Keep the learned variances and lengthscales of window i"""
+        for j in range(len(self.pitches)):
+            self.matrix_var[j, i] = self.model.kern.kern_list[j].variance.value.copy()
+            self.matrix_len[j, i] = self.model.kern.kern_list[j].lengthscales.value.copy()
+
+    def collect_result(self, i, res):
+        """Keep the result of window i optimized by a worker (see parallel.fit_window)"""
+        self.matrix_var[:, i] = np.asarray(res['variance']).reshape(-1, )
+        self.matrix_len[:, i] = np.asarray(res['lengthscale']).reshape(-1, )
+
+    def checkpoint_options(self):
+        """only the learned parameters are checkpointed"""
+        return {}
+
+    def write_result(self, ckpt, res):
+        """Write the result of a worker to the checkpoint"""
+        ckpt.write(res['index'], variance=res['variance'], lengthscale=res['lengthscale'], niter=res['niter'])
+
+    def store_window(self, ckpt, i):
+        """Write the learned parameters of window i to the checkpoint"""
+        ckpt.write(i, variance=self.matrix_var[:, i], lengthscale=self.matrix_len[:, i], niter=self.niter[-1])
+
+    def restore_window(self, ckpt, i):
+        """Load the learned parameters of window i from the checkpoint instead of optimizing it again"""
+        data = ckpt.read(i)
+        self.matrix_var[:, i] = data['variance']
+        self.matrix_len[:, i] = data['lengthscale']
+        self.niter.append(data['niter'])
+        self.warm.append(False)
+        self.stop_reason.append('checkpoint')
 
     def save(self):
         # save results
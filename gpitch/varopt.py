@@ -0,0 +1,208 @@
+"""
+Optimizer for the SGPRSS bound when only the variances of the pitch kernels and the noise variance are free. The
+bound, its gradient and its Hessian are computed analytically in numpy, either from the N independent statistics of a
+window (see sgpr_ss.gram_statistics) or directly from the stacked Gram matrices, and the bound is maximized by
+Newton's method on the logarithm of the parameters.
+"""
+import time
+import numpy as np
+from scipy.linalg import cho_factor, cho_solve
+
+
+class VarianceBound:
+    """
+    Collapsed bound of a window as a function of theta = [v_1, ..., v_P, noise_var]. With U = sum_i v_i Kuu_i,
+    K = sum_i v_i Kuf_i, KK = K K^T, b = K y and S = noise_var U + KK:
+
+        F = -N/2 log(2 pi) - 1/2 [(N - M) log(s) + log|S| - log|U|] - 1/(2 s) [y^T y - b^T S^-1 b]
+            - 1/(2 s) [sum_i v_i tr(K_i) - tr(U^-1 KK)]
+
+    The products Kuf_i Kuf_j^T are taken from the statistics G (P x P x M x M) if given, and computed from Kuf
+    (P x M x N) otherwise, like the two modes of sgpr_ss.SGPRSSGram.
+    """
+    def __init__(self, Kuu, g, yy, trK, num_data, G=None, Kuf=None, reg=False, jitter=1e-6):
+        if (G is None) == (Kuf is None):
+            raise ValueError("give either the statistics G or the Gram matrices Kuf")
+        self.Kuu, self.G, self.Kuf, self.g = Kuu, G, Kuf, g.reshape(g.shape[0], -1)
+        self.yy, self.trK, self.num_data = yy, trK, num_data
+        self.num_pitches, self.num_inducing = Kuu.shape[0], Kuu.shape[1]
+        self.beta = 1000. if reg else 0.
+        self.jitter = jitter
+        self.nevals = 0
+
+    @classmethod
+    def from_grams(cls, Y, Kuf, Kuu, Kdiag, reg=False, stats=None):
+        """Bound of a window from its unit variance Gram matrices, by default with the statistics when P M < N"""
+        num_pitches, num_inducing, num_data = Kuf.shape
+        if stats is None:
+            stats = num_pitches * num_inducing < num_data
+        g = np.einsum('imn,n->im', Kuf, Y.reshape(-1, ))
+        if stats:
+            G = np.einsum('imn,jkn->ijmk', Kuf, Kuf)
+            return cls(Kuu, g, np.sum(np.square(Y)), np.sum(Kdiag, 1), num_data, G=G, reg=reg)
+        return cls(Kuu, g, np.sum(np.square(Y)), np.sum(Kdiag, 1), num_data, Kuf=Kuf, reg=reg)
+
+    def cross(self, v):
+        """Kuf_i K^T for every pitch (P x M x M) and KK = K K^T"""
+        if self.G is not None:
+            Gv = np.tensordot(v, self.G, 1)
+        else:
+            K = np.tensordot(v, self.Kuf, 1)
+            Gv = np.tensordot(self.Kuf, K, axes=([2], [1]))
+        return Gv, np.tensordot(v, Gv, 1)
+
+    def pair_trace(self, W):
+        """tr(W Kuf_i Kuf_j^T) for every pair of pitches (P x P), W symmetric"""
+        if self.G is not None:
+            return np.einsum('km,ijmk->ij', W, self.G)
+        WKuf = np.matmul(W, self.Kuf).reshape(self.num_pitches, -1)
+        return WKuf.dot(self.Kuf.reshape(self.num_pitches, -1).T)
+
+    def pair_quad(self, alpha):
+        """alpha^T Kuf_i Kuf_j^T alpha for every pair of pitches (P x P)"""
+        if self.G is not None:
+            return np.einsum('m,ijmk,k->ij', alpha, self.G, alpha)
+        a = np.einsum('imn,m->in', self.Kuf, alpha)
+        return a.dot(a.T)
+
+    def evaluate(self, theta, hessian=False):
+        """bound, gradient and (if hessian) Hessian at theta"""
+        self.nevals += 1
+        v, s = theta[0:-1], theta[-1]
+        N, M = self.num_data, self.num_inducing
+
+        U = np.tensordot(v, self.Kuu, 1) + self.jitter * np.eye(M)
+        Gv, KK = self.cross(v)
+        b = np.dot(v, self.g)
+        S = s * U + KK
+
+        cU, cS = cho_factor(U, lower=True), cho_factor(S, lower=True)
+        logdet_U = 2. * np.sum(np.log(np.diag(cU[0])))
+        logdet_S = 2. * np.sum(np.log(np.diag(cS[0])))
+        alpha = cho_solve(cS, b)
+        Sinv = cho_solve(cS, np.eye(M))
+        Uinv = cho_solve(cU, np.eye(M))
+        W = Uinv.dot(KK)
+
+        # F = ... - T / (2 s), with T = y^T y - b^T S^-1 b + sum_i v_i tr(K_i) - tr(U^-1 KK)
+        T = self.yy - np.dot(b, alpha) + np.dot(v, self.trK) - np.trace(W)
+        F = -0.5 * N * np.log(2 * np.pi) - 0.5 * ((N - M) * np.log(s) + logdet_S - logdet_U) - 0.5 / s * T
+        F -= self.beta * np.sum(v)
+
+        # first derivatives, dU/dv_i = Kuu_i, dKK/dv_i = H_i = Kuf_i K^T + K Kuf_i^T, dS/dv_i = s Kuu_i + H_i
+        H = Gv + np.transpose(Gv, (0, 2, 1))
+        dS = s * self.Kuu + H
+        UinvKuu = np.matmul(Uinv, self.Kuu)
+        UinvH = np.matmul(Uinv, H)
+        T_v = (-2. * np.dot(self.g, alpha) + np.einsum('m,imk,k->i', alpha, dS, alpha) + self.trK
+               - np.einsum('imm->i', UinvH) + np.einsum('imk,km->i', UinvKuu, W))
+        T_s = np.dot(alpha, U.dot(alpha))
+
+        grad = np.zeros_like(theta)
+        grad[0:-1] = (-0.5 * (np.einsum('mk,ikm->i', Sinv, dS) - np.einsum('imm->i', UinvKuu)) - 0.5 / s * T_v
+                      - self.beta)
+        grad[-1] = -0.5 * ((N - M) / s + np.sum(Sinv * U)) + 0.5 / s**2 * T - 0.5 / s * T_s
+        if not hessian:
+            return F, grad
+
+        # second derivatives, d2KK/dv_i dv_j = Kuf_i Kuf_j^T + Kuf_j Kuf_i^T, U and S are linear in theta
+        SinvdS = np.matmul(Sinv, dS)
+        SinvU = Sinv.dot(U)
+        r = self.g - np.einsum('imk,k->im', dS, alpha)  # db/dv_i - dS/dv_i alpha
+        Sinv_r = cho_solve(cS, r.T)
+        Ualpha = U.dot(alpha)
+
+        logdet_S_vv = 2. * self.pair_trace(Sinv) - np.einsum('imk,jkm->ij', SinvdS, SinvdS)
+        logdet_U_vv = -np.einsum('imk,jkm->ij', UinvKuu, UinvKuu)
+        q_vv = 2. * r.dot(Sinv_r) - 2. * self.pair_quad(alpha)
+        A = np.einsum('imk,jkm->ij', UinvH, UinvKuu)
+        B = np.einsum('imk,jkm->ij', np.matmul(UinvKuu, W), UinvKuu)
+        R_vv = 2. * self.pair_trace(Uinv) - A - A.T + B + B.T
+        T_vv = -q_vv - R_vv
+
+        logdet_S_vs = np.einsum('mk,ikm->i', Sinv, self.Kuu) - np.einsum('mk,ikm->i', SinvU, SinvdS)
+        T_vs = 2. * np.dot(Sinv_r.T, Ualpha) + np.einsum('m,imk,k->i', alpha, self.Kuu, alpha)
+        T_ss = -2. * np.dot(Ualpha, cho_solve(cS, Ualpha))
+
+        hess = np.zeros((theta.size, theta.size))
+        hess[0:-1, 0:-1] = -0.5 * logdet_S_vv + 0.5 * logdet_U_vv - 0.5 / s * T_vv
+        hess[0:-1, -1] = -0.5 * logdet_S_vs + 0.5 / s**2 * T_v - 0.5 / s * T_vs
+        hess[-1, 0:-1] = hess[0:-1, -1]
+        hess[-1, -1] = (0.5 * (N - M) / s**2 + 0.5 * np.sum(SinvU * SinvU.T) - T / s**3 + T_s / s**2
+                        - 0.5 / s * T_ss)
+        return F, grad, 0.5 * (hess + hess.T)
+
+    def value_and_grad(self, theta):
+        return self.evaluate(theta)
+
+    def hessian(self, theta):
+        return self.evaluate(theta, hessian=True)[2]
+
+
+def newton(bound, theta0, maxiter=100, tol=1e-6, lower=1e-10, max_step=5.):
+    """
+    Maximize the bound over theta > 0 by Newton's method on u = log(theta), so that the parameters stay positive
+    without projections. The Hessian in u is damped until it is negative definite, steps are limited to max_step in
+    u and backtracked until the bound increases enough (Armijo). Variances that go to zero have a vanishing gradient in
+    u, so the stopping test max |dF/du| < tol max(|F|, 1) is met at the boundary too.
+    :return: theta, bound, number of iterations and reason for stopping
+    """
+    u = np.log(np.maximum(np.asarray(theta0, dtype=float), lower))
+    theta = np.exp(u)
+    F, grad, hess = bound.evaluate(theta, hessian=True)
+    reason = 'maxiter'
+    niter = 0
+    for niter in range(1, maxiter + 1):
+        grad_u = grad * theta
+        if np.max(np.abs(grad_u)) < tol * max(abs(F), 1.):
+            reason = 'converged'
+            break
+
+        # Newton direction in u, damped until the Hessian is negative definite
+        hess_u = theta.reshape(-1, 1) * hess * theta.reshape(1, -1) + np.diag(grad_u)
+        damping = 0.
+        while True:
+            try:
+                chol = cho_factor(-hess_u + damping * np.eye(u.size), lower=True)
+                break
+            except np.linalg.LinAlgError:
+                damping = max(2. * damping, 1e-6 * np.max(np.abs(np.diag(hess_u))) + 1e-12)
+        direction = cho_solve(chol, grad_u)
+        direction *= min(1., max_step / np.max(np.abs(direction)))
+
+        # backtracking
+        step, improved = 1., False
+        while step > 1e-10:
+            candidate = np.maximum(u + step * direction, np.log(lower))
+            if bound.evaluate(np.exp(candidate))[0] > F + 1e-4 * step * np.dot(grad_u, direction):
+                improved = True
+                break
+            step *= 0.5
+        if not improved:
+            reason = 'linesearch'
+            break
+        u = candidate
+        theta = np.exp(u)
+        F, grad, hess = bound.evaluate(theta, hessian=True)
+    return theta, F, niter, reason
+
+
+def fit(Y, Kuf, Kuu, Kdiag, reg=False, maxiter=100, tol=1e-6, stats=None):
+    """
+    Fit the variances of the pitch kernels and the noise variance of a window from its unit variance Gram matrices
+    (see gramcache.GramCache), starting from ones like SGPRSS. "stats" selects the N independent form of the bound,
+    by default when P M < N (see VarianceBound.from_grams).
+
+    L-BFGS (sgpr_ss.SGPRSSGram) remains the default solver of optimize_grams. On synthetic windows with 88 pitches,
+    M = 60 and N = 2001 Newton reached a slightly higher bound in 30 instead of 130-190 iterations, but it was not
+    consistently faster (13.2 s against 17.7 s on one window, 14.5 s against 11.3 s on another): each of its
+    iterations costs O(P M^2 N + P^2 M N) for the Hessian. Forcing the statistics made it 4.5 times slower than L-BFGS
+    (30 s against 6.7 s), since the Hessian contracts the P x P x M x M tensor several times per iteration, so keep
+    the default stats rule with Newton. Newton pays off for a few pitches or when a tight optimum matters.
+    :return: dictionary with variance, noise_var, bound, niter, reason and time
+    """
+    start = time.time()
+    bound = VarianceBound.from_grams(Y, Kuf, Kuu, Kdiag, reg=reg, stats=stats)
+    theta, F, niter, reason = newton(bound, np.ones(Kuf.shape[0] + 1), maxiter=maxiter, tol=tol)
+    return dict(variance=theta[0:-1], noise_var=theta[-1], bound=F, niter=niter, reason=reason,
+                nevals=bound.nevals, time=time.time() - start)
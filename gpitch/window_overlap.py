@@ -4,7 +4,76 @@ from scipy import signal
 from gpitch.methods import logistic
 
 
-def windowed(x, y, ws):
+class StridedWindows:
+    """
+    Read-only windows of a signal without copies. The windows are rows of a 2-D strided view of the sample buffer,
+    window i starts at sample i*hop. It behaves like a list of ws x 1 arrays.
+    """
+    def __init__(self, y, ws, hop):
+        y = np.ascontiguousarray(y).reshape(-1, )
+        self.ws = ws
+        self.hop = hop
+        self.nw = (y.size - ws) // hop + 1
+        self.data = np.lib.stride_tricks.as_strided(y, shape=(self.nw, ws), strides=(hop*y.strides[0], y.strides[0]))
+        self.data.flags.writeable = False
+
+    def __len__(self):
+        return self.nw
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.nw))]
+        return self.data[i].reshape(-1, 1)
+
+    def __iter__(self):
+        for i in range(self.nw):
+            yield self[i]
+
+
+class TimeWindows:
+    """
+    Time vectors of windows generated on demand from the start index and the sample frequency, nothing is stored.
+    It behaves like a list of ws x 1 arrays.
+    """
+    def __init__(self, n, ws, hop, fs, x0=0.):
+        self.ws = ws
+        self.hop = hop
+        self.fs = fs
+        self.x0 = x0
+        self.nw = (n - ws) // hop + 1
+
+    def __len__(self):
+        return self.nw
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.nw))]
+        if i < 0:
+            i += self.nw
+        if not 0 <= i < self.nw:
+            raise IndexError("window index out of range")
+        return self.x0 + (i*self.hop + np.arange(self.ws).reshape(-1, 1)) / float(self.fs)
+
+    def __iter__(self):
+        for i in range(self.nw):
+            yield self[i]
+
+
+def windowed_views(x, y, ws, hop=None):
+    """
+    Same windows as windowed (50% overlap by default) as zero-copy strided views of y, time vectors are generated on
+    demand from the first sample of x and the sample frequency.
+    """
+    if hop is None:
+        hop = (ws - 1) // 2
+    x = x.reshape(-1, )
+    fs = (x.size - 1.) / (x[-1] - x[0])
+    return TimeWindows(n=x.size, ws=ws, hop=hop, fs=fs, x0=x[0]), StridedWindows(y, ws=ws, hop=hop)
+
+
+def windowed(x, y, ws, views=False):
+    if views:
+        return windowed_views(x, y, ws)
     n = x.size
     l = (ws-1)/2
     nw = (n - ws) / l + 1
@@ -16,47 +85,123 @@ def windowed(x, y, ws):
     return xout, yout
 
 
+class OverlapAdder:
+    """
+    Incremental overlap-add of windows with 50% overlap (hop of (ws-1)/2 samples). Windows are added one at a time,
+    the mean weighted by a Hann window and the variance by its square. The first half of the first window and the
+    second half of the last window are not weighted.
+
+    The output of all sources is written into preallocated arrays of shape n x nsources (self.mean and self.var),
+    memory-mapped .npy files if filename is given. With n=None no output array is kept, and the finished samples must
+    be taken with pop().
+    """
+    def __init__(self, ws, n=None, nsources=1, filename=None):
+        self.ws = ws
+        self.hop = (ws - 1) // 2
+        self.n = n
+        self.nsources = nsources
+
+        # window weights are computed only once
+        self.win = signal.hann(ws).reshape(-1, 1)
+        self.win_first = self.win.copy()
+        self.win_first[0:self.hop] = 1.
+
+        self.nwin = 0  # number of windows added
+        self.nfinished = 0  # number of samples whose value is final
+        self.npopped = 0  # number of samples already taken with pop
+        self.tail = [np.zeros((self.hop + 1, nsources)), np.zeros((self.hop + 1, nsources))]
+        self.last = [None, None]  # raw second half of the last window
+        self.ready = []  # finished blocks not yet popped (only if n is None)
+
+        if n is None:
+            self.mean, self.var = None, None
+        elif filename is None:
+            self.mean, self.var = np.zeros((n, nsources)), np.zeros((n, nsources))
+        else:
+            self.mean = np.lib.format.open_memmap(filename + '_mean.npy', mode='w+', dtype=float,
+                                                  shape=(n, nsources))
+            self.var = np.lib.format.open_memmap(filename + '_var.npy', mode='w+', dtype=float, shape=(n, nsources))
+
+    def _as_array(self, y):
+        """window as a ws x nsources array, y can be an array or a list with one ws x 1 array per source"""
+        if y is None:
+            return None
+        if isinstance(y, (list, tuple)):
+            y = np.hstack([np.asarray(yk).reshape(-1, 1) for yk in y])
+        return np.asarray(y, dtype=float).reshape(self.ws, -1)
+
+    def _write(self, start, mean, var):
+        if self.n is None:
+            self.ready.append([mean, var])
+        else:
+            if mean is not None:
+                self.mean[start:start + mean.shape[0]] = mean
+            if var is not None:
+                self.var[start:start + var.shape[0]] = var
+
+    def add(self, mean=None, var=None):
+        """Add the next window of the mean and/or the variance (ws x nsources arrays or lists of ws x 1 arrays)"""
+        mean, var = self._as_array(mean), self._as_array(var)
+        win = self.win_first if self.nwin == 0 else self.win
+        start = self.nwin * self.hop
+        hop = self.hop
+
+        block = [None, None]
+        for k, (y, w) in enumerate([(mean, win), (var, win**2)]):
+            if y is None:
+                continue
+            head = self.tail[k] + w[0:hop + 1] * y[0:hop + 1]
+            block[k] = head[0:hop].copy()
+            self.tail[k] = w[hop:] * y[hop:]
+            self.tail[k][0] = head[hop]
+            self.last[k] = y[hop:].copy()
+
+        # first half of the window (overlapped with the previous one) is finished
+        self._write(start, block[0], block[1])
+        self.nfinished = start + hop
+        self.nwin += 1
+
+    def finish(self):
+        """No more windows, the second half of the last window is finished"""
+        if self.nwin == 0:
+            return
+        start = (self.nwin - 1) * self.hop + self.hop
+        self._write(start, self.last[0], self.last[1])
+        self.nfinished = start + self.hop + 1
+
+    def pop(self):
+        """
+        Samples finished since the last call. Returns the index of the first sample, the mean and the variance. If n
+        is None the samples are released from memory.
+        """
+        index = self.npopped
+        if self.n is None:
+            mean = [b[0] for b in self.ready if b[0] is not None]
+            var = [b[1] for b in self.ready if b[1] is not None]
+            mean = np.vstack(mean) if len(mean) > 0 else None
+            var = np.vstack(var) if len(var) > 0 else None
+            self.ready = []
+        else:
+            mean = self.mean[self.npopped:self.nfinished]
+            var = self.var[self.npopped:self.nfinished]
+        self.npopped = self.nfinished
+        return index, mean, var
+
+
 def merged_mean(y, ws, n):
-    nw = len(y)
-    ll = (ws-1)/2
+    adder = OverlapAdder(ws=ws, n=n)
     for i in range(len(y)):
-        if i == 0:
-            win = signal.hann(ws).reshape(-1, 1)
-            win[0:ll] = 1.
-        elif i == nw-1:
-            win = signal.hann(ws).reshape(-1, 1)
-            win[-ll:] = 1.
-        else:
-            win = signal.hann(ws).reshape(-1, 1)
-        y[i] = y[i]*win
-    yout = np.zeros((n, 1))
-    yout[0:ll] = y[0][0:ll]
-    yout[-ll:] = y[-1][-ll:]
-    for i in range(nw-1):
-        yout[(i + 1) * ll: (i + 2) * ll + 1] = y[i][ll:].copy() + y[i+1][0:ll+1].copy()
-    return yout
+        adder.add(mean=y[i])
+    adder.finish()
+    return adder.mean
 
 
 def merged_variance(y, ws, n):
-    nw = len(y)
-    ll = (ws-1)/2
+    adder = OverlapAdder(ws=ws, n=n)
     for i in range(len(y)):
-        if i == 0:
-            win = signal.hann(ws).reshape(-1, 1)
-            win[0:ll] = 1.
-        elif i == nw-1:
-            win = signal.hann(ws).reshape(-1, 1)
-            win[-ll:] = 1.
-        else:
-            win = signal.hann(ws).reshape(-1, 1)
-        win = win**2
-        y[i] = y[i]*win
-    yout = np.zeros((n, 1))
-    yout[0:ll] = y[0][0:ll]
-    yout[-ll:] = y[-1][-ll:]
-    for i in range(nw-1):
-        yout[(i + 1) * ll: (i + 2) * ll + 1] = y[i][ll:].copy() + y[i+1][0:ll+1].copy()
-    return yout
+        adder.add(var=y[i])
+    adder.finish()
+    return adder.var
 
 
 def merged_x(x, ws):
@@ -191,11 +336,14 @@ def plot_patches(x, y, rm, s_l):
 # ____________________________________________________________________________
 
 
-def segmented(x, y, window_size=32000, aug=False):
+def segmented(x, y, window_size=32000, aug=False, views=False):
     """
     segmentates the input data into arrays of size nw. Returns a list with segments.
     The augmentation corresponds to 50 miliseconds (800 samples) assuming 16kHz of sampling rate.
+    With views=True (and no augmentation) the segments are zero-copy views of the data.
     """
+    if views and not aug:
+        return windowed_views(x, y, ws=window_size, hop=window_size)
     num_windows = y.size/window_size
     xs = []  # time vector segmented
     ys = []  # data segmented
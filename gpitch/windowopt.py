@@ -0,0 +1,396 @@
+import time
+import numpy as np
+import gpitch
+
+
+class WindowOptimizer:
+    """
+    Window by window optimization shared by SoSp and AMT. The models differ in what they keep for every window, so a
+    class using this mixin defines the class attributes
+
+        scale: factor applied to the data of a window before fitting it
+        len_fixed: True if the lengthscales of the pitch kernels are fixed
+        predict_sources: True if the mixture and the sources are predicted after fitting every window
+
+    and the methods reset_model, window_state, warm_model, skip_window, save_window (keep the fitted hyperparameters
+    of the model, and predictions, for window i), collect_result (the same from the result of a worker),
+    checkpoint_options, write_result, store_window and restore_window.
+    """
+
+    def reset_results(self):
+        """forget the results of a previous optimization"""
+        self.mean = []
+        self.var = []
+        self.smean = []
+        self.svar = []
+        self.niter = []
+        self.warm = []
+        self.stop_reason = []
+        self.opt_time = []
+        self.opt_shape = []
+        self.opt_bound = []
+
+    def init_buckets(self, num_buckets=4, multiple=8):
+        """
+        The number of extrema used as inducing points changes from window to window. Pad every inducing set up to one
+        of "num_buckets" fixed sizes instead, so that the model only sees a few Z shapes (see sgpr_ss.bucket_sizes).
+        The padded points are masked out of the bound and of the predictions.
+        """
+        sizes = [z.shape[0] for z in self.inducing[0]]
+        self.buckets = gpitch.sgpr_ss.bucket_sizes(sizes, num_buckets=num_buckets, multiple=multiple)
+
+    def report_buckets(self):
+        """
+        Number of distinct Z shapes without and with bucketing, relative number of padded inducing points and, after
+        optimize, the mean time of the windows that were the first of their Z shape (graph compilation and memory
+        allocation) and of the others.
+        """
+        sizes = np.array([z.shape[0] for z in self.inducing[0]])
+        padded = sizes if self.buckets is None else np.array([gpitch.sgpr_ss.bucket_size(m, self.buckets)
+                                                              for m in sizes])
+        report = dict(shapes=len(set(sizes.tolist())), bucketed_shapes=len(set(padded.tolist())),
+                      padding=np.sum(padded) / float(np.sum(sizes)) - 1.)
+        if len(self.opt_shape) > 0:
+            first = np.array([m not in self.opt_shape[0:k] for k, m in enumerate(self.opt_shape)])
+            report['first_time'] = np.mean(np.asarray(self.opt_time)[first])
+            report['time'] = np.mean(np.asarray(self.opt_time)[~first]) if (~first).any() else np.nan
+        print("Z shapes: " + str(report['shapes']) + ", with buckets: " + str(report['bucketed_shapes']) +
+              ", padding: " + str(round(100. * report['padding'], 1)) + "%")
+        return report
+
+    def report_iterations(self, reference=None):
+        """
+        Summary of the number of optimizer iterations per window. "reference" is the list niter of a previous run
+        (e.g. without warm start) on the same windows, used to compute the number of iterations saved.
+        """
+        active = np.asarray(self.active[0:len(self.niter)], dtype=bool)  # skipped windows are not counted
+        niter = np.asarray(self.niter, dtype=float)[active]
+        warm = np.asarray(self.warm, dtype=bool)[active]
+        report = dict(total=niter.sum(),
+                      warm_windows=warm.sum(),
+                      mean_warm=niter[warm].mean() if warm.any() else np.nan,
+                      mean_cold=niter[~warm].mean() if (~warm).any() else np.nan)
+        if reference is not None:
+            report['saved'] = np.sum(np.asarray(reference)[0:active.size][active]) - niter.sum()
+        return report
+
+    def worker_spec(self, maxiter=1000, disp=1, gpu='', monitor=None):
+        """Everything a worker process needs to build its own copy of the model"""
+        return dict(lengthscale=self.params[0],
+                    energy=self.params[1],
+                    frequency=self.params[2],
+                    len_fixed=self.len_fixed,
+                    vectorized=self.vectorized,
+                    bank=self.bank,
+                    buckets=self.buckets,
+                    reg=self.model.reg,
+                    sparse_source=self.model.sparse_source,
+                    window=(self.test_data.X[0].copy(), self.test_data.Y[0].copy(), self.inducing[0][0].copy()),
+                    scale=self.scale,
+                    predict=self.predict_sources,
+                    maxiter=maxiter,
+                    disp=disp,
+                    monitor=monitor,
+                    gpu=gpu)
+
+    def energy_gate(self, thres, nwin=None):
+        """
+        Mark the windows whose energy (relative to the most energetic one) is below thres, they are not optimized.
+        Returns the fraction of windows skipped.
+        """
+        if nwin is None:
+            nwin = len(self.test_data.Y)
+        self.active, skipped = gpitch.energy_gate(self.test_data.Y[0:nwin], thres=thres)
+        print("skipping " + str(np.sum(~self.active)) + " of " + str(nwin) + " windows (" +
+              str(round(100.*skipped, 1)) + "%)")
+        return skipped
+
+    def fingerprint(self):
+        """Description of the run stored in the checkpoint, a checkpoint of a different run is not resumed"""
+        return dict(data=gpitch.checkpoint.data_hash(self.test_data.y), name=self.test_data.name,
+                    pitches=list(self.pitches), window_size=self.test_data.wsize, reg=self.model.reg,
+                    vectorized=self.vectorized, bank=self.bank, buckets=self.num_buckets)
+
+    def open_checkpoint(self, filename, nwin, resume=True):
+        """HDF5 checkpoint for the results of nwin windows, see gpitch.checkpoint.Checkpoint"""
+        ckpt = gpitch.checkpoint.Checkpoint(filename, nwin=nwin, npitches=len(self.pitches), resume=resume,
+                                            fingerprint=self.fingerprint(), **self.checkpoint_options())
+        if ckpt.num_done() > 0:
+            print("resuming from checkpoint, " + str(ckpt.num_done()) + " of " + str(nwin) + " windows done")
+        return ckpt
+
+    def optimize(self, maxiter=1000, disp=1, nwin=None, processes=None, chunksize=1, warm_start=False, blend=0.,
+                 gate=None, monitor=None, checkpoint=None, resume=True, solver=None):
+        """
+        Optimize the windows one by one (or in "processes" worker processes). If "checkpoint" is the name of an HDF5
+        file, every finished window is written to it, and with resume=True the windows already in the file are
+        loaded instead of optimized again, so an interrupted run can be continued. By default all the hyperparameters
+        of SGPRSS are fitted; with "solver" ('lbfgs' or 'newton') only the variances are, see optimize_grams and
+        compare_solvers. Every worker process is a new python interpreter that builds its own model, see
+        parallel.optimize_windows.
+        """
+        if solver is not None:
+            if processes is not None or warm_start or gate is not None or checkpoint is not None:
+                raise ValueError("solver can not be combined with processes, warm_start, gate or checkpoint")
+            return self.optimize_grams(maxiter=maxiter, disp=disp, nwin=nwin, solver=solver)
+
+        self.reset_results()
+
+        if nwin is None:
+            nwin = len(self.test_data.Y)
+
+        if processes is not None and warm_start:
+            raise ValueError("warm start chains consecutive windows, it can not be used with parallel optimization")
+
+        # skip silent windows
+        self.active = np.ones(nwin, dtype=bool)
+        if gate is not None:
+            self.energy_gate(thres=gate, nwin=nwin)
+
+        ckpt = None
+        if checkpoint is not None:
+            ckpt = self.open_checkpoint(checkpoint, nwin=nwin, resume=resume)
+
+        try:
+            if processes is not None:
+                self.optimize_parallel(nwin=nwin, maxiter=maxiter, disp=disp, processes=processes,
+                                       chunksize=chunksize, monitor=monitor, ckpt=ckpt)
+            else:
+                self.optimize_serial(nwin=nwin, maxiter=maxiter, disp=disp, warm_start=warm_start, blend=blend,
+                                     monitor=monitor, ckpt=ckpt)
+        finally:
+            if ckpt is not None:
+                ckpt.close()
+
+    def optimize_parallel(self, nwin, maxiter, disp, processes, chunksize, monitor, ckpt=None):
+        """optimize windows in parallel, each worker builds its model once and reuses it for all its windows"""
+        def pending(i):
+            return self.active[i] and (ckpt is None or not ckpt.done(i))
+
+        def store(res):
+            if ckpt is not None:
+                self.write_result(ckpt, res)
+
+        tasks = ((i, self.test_data.X[i], self.test_data.Y[i], self.inducing[0][i])
+                 for i in range(nwin) if pending(i))
+        spec = self.worker_spec(maxiter=maxiter, disp=disp, monitor=monitor)
+        results = gpitch.parallel.optimize_windows(spec=spec, tasks=tasks, processes=processes,
+                                                   chunksize=chunksize, callback=store)
+        results = dict([(res['index'], res) for res in results])
+        for i in range(nwin):
+            if ckpt is not None and ckpt.done(i) and i not in results:
+                self.restore_window(ckpt, i)
+                continue
+            if not self.active[i]:
+                self.skip_window(i)
+                if ckpt is not None:
+                    self.store_window(ckpt, i)
+                continue
+            res = results[i]
+            self.collect_result(i, res)
+            self.niter.append(res['niter'])
+            self.warm.append(False)
+            self.stop_reason.append(res['reason'])
+
+    def optimize_serial(self, nwin, maxiter, disp, warm_start, blend, monitor, ckpt=None):
+        """optimize windows one after the other, optionally starting each one from the optimum of the previous"""
+        state = None
+        for i in range(nwin):
+
+            if ckpt is not None and ckpt.done(i):
+                self.restore_window(ckpt, i)
+                state = None
+                continue
+
+            if not self.active[i]:
+                self.skip_window(i)
+                if ckpt is not None:
+                    self.store_window(ckpt, i)
+                continue
+
+            # reset model
+            self.reset_model(x=self.test_data.X[i],
+                             y=self.test_data.Y[i],
+                             z=self.inducing[0][i])
+
+            # start from the optimum of the previous window, unless the bound is worse than with the defaults
+            warm = False
+            if warm_start and state is not None:
+                bound_cold = self.model.compute_log_likelihood()
+                self.warm_model(state, blend=blend)
+                if self.model.compute_log_likelihood() >= bound_cold:
+                    warm = True
+                else:
+                    self.warm_model(state, blend=1.)
+
+            # optimize window
+            print("optimizing window " + str(i))
+            start = time.time()
+            result = gpitch.convergence.optimize(self.model, monitor=monitor, maxiter=maxiter, disp=disp)
+            self.opt_time.append(time.time() - start)
+            self.opt_shape.append(self.model.Z.value.shape[0])
+            self.opt_bound.append(final_bound(result))
+            self.niter.append(getattr(result, 'nit', maxiter))
+            self.stop_reason.append(getattr(result, 'message', None))
+            self.warm.append(warm)
+            state = self.window_state()
+
+            # save learned params (and predictions)
+            self.save_window(i)
+
+            if ckpt is not None:
+                self.store_window(ckpt, i)
+
+    def set_window_params(self, i, noise_var, variance, lengthscale=None, energy=None, frequency=None):
+        """Reset the model to window i and set the hyperparameters fitted for it by another model"""
+        self.reset_model(x=self.test_data.X[i], y=self.test_data.Y[i], z=self.inducing[0][i])
+        self.model.likelihood.variance = noise_var
+        for j in range(len(self.pitches)):
+            self.model.kern.kern_list[j].variance = variance[j]
+            if lengthscale is not None:
+                self.model.kern.kern_list[j].lengthscales = lengthscale[j]
+            if energy is not None:
+                self.model.kern.kern_list[j].set_partials(energy[j], frequency[j])
+
+    def optimize_batched(self, batch_size=8, maxiter=1000, disp=1, nwin=None):
+        """
+        Optimize "batch_size" windows at once in a single BatchSGPRSS graph, every window with its own
+        hyperparameters, the same ones as fitted by optimize (energies and frequencies included). Every window starts
+        from the initial hyperparameters, there is no warm start. The learned hyperparameters are then set in the
+        model and kept (with predictions) window by window. The iterations, stop reason and wall-clock time of a batch
+        are recorded for each of its windows, the time split evenly between them.
+        """
+        self.reset_results()
+
+        if nwin is None:
+            nwin = len(self.test_data.Y)
+
+        batch_model = None
+        for start in range(0, nwin, batch_size):
+            idx = range(start, min(start + batch_size, nwin))
+
+            # stack windows, inducing points are padded up to the largest set in the batch
+            num_inducing = max([self.inducing[0][i].shape[0] for i in idx])
+            zpad = [gpitch.sgpr_ss.pad_inducing(self.inducing[0][i], num_inducing) for i in idx]
+            x = np.stack([self.test_data.X[i] for i in idx])
+            y = self.scale * np.stack([self.test_data.Y[i] for i in idx])
+            z = np.stack([zp[0] for zp in zpad])
+            zmask = np.stack([zp[1] for zp in zpad])
+
+            if batch_model is None or len(idx) != batch_model.variance.value.shape[0]:
+                batch_model = gpitch.sgpr_ss.BatchSGPRSS(X=x, Y=y, Z=z, Zmask=zmask, energy=self.params[1],
+                                                         frequency=self.params[2], lengthscale=self.params[0],
+                                                         len_fixed=self.len_fixed, reg=self.model.reg)
+            else:
+                batch_model.X, batch_model.Y, batch_model.Z, batch_model.Zmask = x, y, z, zmask
+                batch_model.reset_params()
+
+            print("optimizing windows " + str(idx[0]) + " to " + str(idx[-1]))
+            start_time = time.time()
+            result = batch_model.optimize(disp=disp, maxiter=maxiter)
+            elapsed = time.time() - start_time
+            bounds = batch_model.compute_bounds()
+
+            # save learned params (and predictions) window by window
+            for b, i in enumerate(idx):
+                energy, frequency = batch_model.partials(b)
+                self.set_window_params(i, noise_var=batch_model.noise_var.value[b],
+                                       variance=batch_model.variance.value[b],
+                                       lengthscale=None if self.len_fixed else batch_model.lengthscales.value[b],
+                                       energy=energy, frequency=frequency)
+                self.opt_time.append(elapsed / len(idx))
+                self.opt_shape.append(num_inducing)
+                self.opt_bound.append(float(bounds[b]))
+                self.niter.append(getattr(result, 'nit', maxiter))
+                self.stop_reason.append(gpitch.convergence.stop_reason(result))
+                self.warm.append(False)
+                self.save_window(i)
+
+    def optimize_grams(self, maxiter=1000, disp=1, nwin=None, cache=None, stats=None, solver='lbfgs', grid=None):
+        """
+        Optimize only the variances of the pitch kernels (and the noise variance) window by window, with the Gram
+        matrices of the pitch kernels fixed: energies, frequencies and lengthscales are held at their initial values.
+        This is a restricted version of the model fitted by optimize, where energies and frequencies (and in AMT the
+        lengthscales) are free too, not a faster way to obtain the same fit. The unit variance Gram matrices of every
+        pitch are taken from "cache" (a gramcache.GramCache, a new one by default), so windows with the same relative
+        grid and inducing pattern skip kernel evaluation entirely. The extrema used as inducing inputs differ from
+        window to window, so the cache rarely hits across windows; with "grid" (an integer) every grid-th input of a
+        window is used as inducing input instead and all full windows share their Gram matrices. "stats" selects the
+        N independent form of the bound, see sgpr_ss.SGPRSSGram. With solver='newton' the variances are fitted by
+        Newton's method on the analytic bound (see varopt) instead of L-BFGS, which stays the default (see varopt.fit).
+        The wall-clock time and the final bound of every window are kept in self.opt_time and self.opt_bound.
+        """
+        self.reset_results()
+
+        if nwin is None:
+            nwin = len(self.test_data.Y)
+        if cache is None:
+            cache = gpitch.gramcache.GramCache()
+        self.gram_cache = cache
+
+        gram_model = None
+        for i in range(nwin):
+            x, y, z = self.test_data.X[i], self.scale * self.test_data.Y[i], self.inducing[0][i]
+            if grid is not None:
+                z = x[::grid].copy()
+            self.reset_model(x=x, y=self.test_data.Y[i], z=z)
+            Kuf, Kuu, Kdiag = cache.window(self.model.kern.kern_list, x, z)
+
+            print("optimizing window " + str(i))
+            if solver == 'newton':
+                result = gpitch.varopt.fit(Y=y, Kuf=Kuf, Kuu=Kuu, Kdiag=Kdiag, reg=self.model.reg, maxiter=maxiter,
+                                           stats=stats)
+                noise_var, variance = result['noise_var'], result['variance']
+                self.niter.append(result['niter'])
+                self.stop_reason.append(result['reason'])
+                self.opt_time.append(result['time'])
+                self.opt_bound.append(result['bound'])
+            else:
+                start = time.time()
+                if gram_model is None:
+                    gram_model = gpitch.sgpr_ss.SGPRSSGram(Y=y.copy(), Kuf=Kuf, Kuu=Kuu, Kdiag=Kdiag,
+                                                           reg=self.model.reg, stats=stats)
+                else:
+                    gram_model.set_window(Y=y.copy(), Kuf=Kuf, Kuu=Kuu, Kdiag=Kdiag)
+                result = gram_model.optimize(disp=disp, maxiter=maxiter)
+                noise_var, variance = gram_model.noise_var.value, gram_model.variance.value
+                self.niter.append(getattr(result, 'nit', maxiter))
+                self.stop_reason.append(gpitch.convergence.stop_reason(result))
+                self.opt_time.append(time.time() - start)
+                self.opt_bound.append(final_bound(result))
+
+            # save learned params (and predictions), the inducing inputs used for the Gram matrices are kept
+            self.model.likelihood.variance = noise_var
+            for j in range(len(self.pitches)):
+                self.model.kern.kern_list[j].variance = variance[j]
+            self.save_window(i)
+        print("gram cache hit rate " + str(round(cache.hit_rate(), 3)))
+
+    def compare_solvers(self, nwin=5, maxiter=1000):
+        """
+        Wall-clock time, iterations and final bound, summed over the first nwin windows, of the baseline optimize (all
+        the hyperparameters of SGPRSS fitted by model.optimize) and of the variance-only fits of optimize_grams with
+        L-BFGS and with Newton's method. The times include building the Gram matrices and the predictions. The
+        baseline fits a larger model, so its bound is usually the highest; speedups are relative to its time.
+        """
+        report = {}
+        for solver in [None, 'lbfgs', 'newton']:
+            start = time.time()
+            if solver is None:
+                self.optimize(maxiter=maxiter, disp=0, nwin=nwin)
+            else:
+                self.optimize_grams(maxiter=maxiter, disp=0, nwin=nwin, solver=solver)
+            report[solver or 'optimize'] = dict(time=time.time() - start, niter=np.sum(self.niter),
+                                                bound=np.sum(self.opt_bound),
+                                                variance=self.matrix_var[:, 0:nwin].copy())
+        for name in ['optimize', 'lbfgs', 'newton']:
+            report[name]['speedup'] = report['optimize']['time'] / report[name]['time']
+            print(name + ": " + str(round(report[name]['time'], 3)) + " s, " + str(int(report[name]['niter'])) +
+                  " iterations, bound " + str(round(report[name]['bound'], 3)))
+        return report
+
+
+def final_bound(result):
+    """bound at the end of an optimization, from the scipy result (which holds minus the bound)"""
+    fun = getattr(result, 'fun', None)
+    return np.nan if fun is None else -float(np.squeeze(fun))